@@ -1,10 +1,22 @@
-from flask import Flask, jsonify, Response
+from flask import Flask, jsonify, Response, request
 from flask_cors import CORS
 from azure.storage.blob import ContainerClient
+from azure.core.exceptions import ResourceNotFoundError
 from dotenv import load_dotenv
+import pyarrow as pa
+import pyarrow.parquet as pq
+import io
 import os
+import sys
+import time
+import threading
 import requests
 
+# Make the pipeline's src/ package importable when run as `python backend/app.py`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.similarity import EmbeddingIndex, BLOB_INDEX_PATH
+from src.run_manifest import recording_id
+
 load_dotenv()
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
@@ -99,6 +111,231 @@ def download_file(filename):
         print(f"Error downloading file {filename}: {str(e)}")
         return jsonify({"error": str(e)}), 404
 
+# ---------------------------
+# Prediction results index
+# ---------------------------
+RESULTS_PREFIX = "predictions/store/"
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Where the transfer stage puts the audio, and how long a listing of it is reused
+AUDIO_PREFIX = "recordings/"
+AUDIO_EXTENSIONS = ('.wav', '.mp3', '.m4a', '.ogg')
+AUDIO_LISTING_TTL_SECONDS = 60
+
+
+class PredictionIndex:
+    """
+    In-memory index of the Parquet results store, keyed by recording ID.
+
+    Only partition files that are new (or whose etag changed) since the last
+    refresh are downloaded, so repeated page requests stay cheap.
+    """
+
+    def __init__(self, client, prefix=RESULTS_PREFIX):
+        self.client = client
+        self.prefix = prefix
+        self._etags = {}
+        self._by_part = {}
+        self._by_recording = {}
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        with self._lock:
+            seen = {}
+            changed = False
+            for blob in self.client.list_blobs(name_starts_with=self.prefix):
+                if not blob.name.endswith(".parquet"):
+                    continue
+                seen[blob.name] = blob.etag
+                if self._etags.get(blob.name) != blob.etag:
+                    self._by_part[blob.name] = self._read_part(blob.name)
+                    changed = True
+
+            for name in set(self._etags) - set(seen):
+                self._by_part.pop(name, None)
+                changed = True
+
+            self._etags = seen
+            if changed:
+                self._rebuild()
+
+    def _read_part(self, blob_name):
+        data = self.client.download_blob(blob_name).readall()
+        table = pq.read_table(pa.BufferReader(data))
+        run_id = ""
+        for segment in blob_name.split("/"):
+            if segment.startswith("run_id="):
+                run_id = segment[len("run_id="):]
+        rows = table.to_pylist()
+        for row in rows:
+            row["run_id"] = run_id
+            if row.get("created_at") is not None:
+                row["created_at"] = row["created_at"].isoformat()
+        return rows
+
+    def _rebuild(self):
+        by_recording = {}
+        run_started = {}
+        for rows in self._by_part.values():
+            for row in rows:
+                by_recording.setdefault(row["recording"], []).append(row)
+                created_at = row.get("created_at") or ""
+                if row["run_id"] not in run_started or created_at < run_started[row["run_id"]]:
+                    run_started[row["run_id"]] = created_at
+        for rows in by_recording.values():
+            # Newest run first; run IDs do not sort by time, their first created_at does
+            rows.sort(key=lambda r: (run_started[r["run_id"]], r.get("created_at") or ""), reverse=True)
+        self._by_recording = by_recording
+
+    def lookup(self, recording):
+        return self._by_recording.get(recording, [])
+
+
+class AudioListing:
+    """
+    Names of the audio blobs under AUDIO_PREFIX, listed at most once per TTL.
+
+    Paging through /api/predictions reads this cached list instead of listing
+    the container on every request.
+    """
+
+    def __init__(self, client, prefix=AUDIO_PREFIX, ttl=AUDIO_LISTING_TTL_SECONDS):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self._names = []
+        self._listed_at = None
+        self._lock = threading.Lock()
+
+    def names(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._listed_at is None or now - self._listed_at > self.ttl:
+                self._names = [
+                    blob.name for blob in self.client.list_blobs(name_starts_with=self.prefix)
+                    if blob.name.lower().endswith(AUDIO_EXTENSIONS)
+                ]
+                self._listed_at = now
+            return self._names
+
+
+prediction_index = PredictionIndex(container_client)
+audio_listing = AudioListing(container_client)
+
+
+@app.route('/api/predictions')
+def list_predictions():
+    try:
+        page = max(int(request.args.get('page', 1)), 1)
+        page_size = int(request.args.get('page_size', DEFAULT_PAGE_SIZE))
+        page_size = min(max(page_size, 1), MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"error": "page and page_size must be integers"}), 400
+
+    try:
+        prediction_index.refresh()
+
+        audio_names = audio_listing.names()
+        start = (page - 1) * page_size
+        items = []
+        for name in audio_names[start:start + page_size]:
+            recording = recording_id(name)
+            items.append({
+                "name": name,
+                "recording": recording,
+                "url": f"http://localhost:5000/api/audio/{name}",
+                "predictions": prediction_index.lookup(recording),
+            })
+
+        return jsonify({
+            "page": page,
+            "page_size": page_size,
+            "total": len(audio_names),
+            "items": items,
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/predictions/<path:recording>')
+def get_predictions(recording):
+    try:
+        prediction_index.refresh()
+        recording = recording_id(recording)
+        return jsonify({
+            "recording": recording,
+            "predictions": prediction_index.lookup(recording),
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# ---------------------------
+# Similar recordings
+# ---------------------------
+MAX_SIMILAR = 50
+
+
+class SimilarityIndexCache:
+    """
+    Embedding index published by the pipeline, re-downloaded only when its etag changes.
+    """
+
+    def __init__(self, client, blob_name=BLOB_INDEX_PATH):
+        self.client = client
+        self.blob_name = blob_name
+        self._etag = None
+        self._index = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            blob_client = self.client.get_blob_client(self.blob_name)
+            etag = blob_client.get_blob_properties().etag
+            if etag != self._etag:
+                data = blob_client.download_blob().readall()
+                self._index = EmbeddingIndex.load(io.BytesIO(data))
+                self._etag = etag
+            return self._index
+
+
+similarity_index = SimilarityIndexCache(container_client)
+
+
+@app.route('/api/similar/<path:recording>')
+def similar_recordings(recording):
+    try:
+        k = min(max(int(request.args.get('k', 5)), 1), MAX_SIMILAR)
+    except ValueError:
+        return jsonify({"error": "k must be an integer"}), 400
+
+    try:
+        index = similarity_index.get()
+        prediction_index.refresh()
+        recording = recording_id(recording)
+        vectors = index.vectors_for(recording)
+        if len(vectors) == 0:
+            return jsonify({"error": f"No embedding indexed for {recording}"}), 404
+
+        # Ask for extra neighbours since the recording itself is among them
+        sims, ids = index.search(vectors[:1], k=k + len(vectors))
+        neighbours = []
+        for other, sim in zip(ids[0], sims[0]):
+            if other == "" or other == recording:
+                continue
+            neighbours.append({
+                "recording": str(other),
+                "similarity": float(sim),
+                "predictions": prediction_index.lookup(str(other)),
+            })
+            if len(neighbours) == k:
+                break
+
+        return jsonify({"recording": recording, "similar": neighbours})
+    except ResourceNotFoundError:
+        return jsonify({"error": "Similarity index has not been published yet"}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/comments', methods=['POST'])
 def save_comment():
     # This would typically save to a database
@@ -0,0 +1,201 @@
+# Startup benchmark for the RED-RHD pipeline CLI
+# Measures, each in a fresh interpreter, how long it takes to import main.py,
+# to print `main.py --help`, and to load the dependencies of every stage.
+#
+# A stage's dependencies are read from the imports in its function in main.py
+# (and the main.py helpers it calls), so the list cannot drift from the code.
+#
+# Usage (from the repository root):
+#     python benchmarks/bench_startup.py [--repeat 3]
+
+import os
+import sys
+import ast
+import inspect
+import argparse
+import subprocess
+import statistics
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import main as pipeline
+
+# CLI stage -> its entry point in main.py
+STAGE_FUNCTIONS = {
+    "transfer": "transfer_stage",
+    "download": "download_stage",
+    "embed": "embed_stage",
+    "score": "score_stage",
+    "publish": "publish_stage",
+}
+
+# Options that change what a stage imports, measured besides its defaults
+STAGE_VARIANTS = {
+    "embed": [{"backend": "dask"}, {"frontend_cache": True}],
+    "score": [{"routing": "region"}],
+}
+
+
+def _branch_taken(test, args):
+    """
+    Whether an `if` on a stage argument is taken, or None if `test` is anything else.
+    """
+    if isinstance(test, ast.Name) and test.id in args:
+        return bool(args[test.id])
+    if (isinstance(test, ast.Compare) and isinstance(test.left, ast.Name) and test.left.id in args
+            and len(test.ops) == 1 and isinstance(test.comparators[0], ast.Constant)):
+        value, constant = args[test.left.id], test.comparators[0].value
+        if isinstance(test.ops[0], ast.Eq):
+            return value == constant
+        if isinstance(test.ops[0], ast.NotEq):
+            return value != constant
+    return None
+
+
+def _defaults(function_name):
+    parameters = inspect.signature(getattr(pipeline, function_name)).parameters
+    return {name: p.default for name, p in parameters.items() if p.default is not inspect.Parameter.empty}
+
+
+def _call_args(call, function, args):
+    """
+    Arguments of a call to a main.py helper that are constants or known stage arguments.
+    """
+    bound = _defaults(function.name)
+    names = [arg.arg for arg in function.args.args]
+    passed = list(zip(names, call.args)) + [(kw.arg, kw.value) for kw in call.keywords if kw.arg]
+    for name, value in passed:
+        bound.pop(name, None)
+        if isinstance(value, ast.Constant):
+            bound[name] = value.value
+        elif isinstance(value, ast.Name) and value.id in args:
+            bound[name] = args[value.id]
+    return bound
+
+
+def stage_modules(stage, **options):
+    """
+    Modules `stage` imports when run with `options`, read from main.py.
+
+    Follows the stage function and every main.py helper it calls. An `if` on
+    a known argument (an option, a default, or a value passed down to a
+    helper) is resolved; any other branch counts as taken.
+    """
+    tree = ast.parse(inspect.getsource(pipeline))
+    functions = {node.name: node for node in tree.body if isinstance(node, ast.FunctionDef)}
+
+    entry = functions[STAGE_FUNCTIONS[stage]]
+    args = dict(_defaults(entry.name), **options)
+
+    modules = []
+    visited = {entry.name}
+
+    def visit(node, args):
+        if isinstance(node, ast.If):
+            taken = _branch_taken(node.test, args)
+            branches = [node.body] if taken else [node.orelse] if taken is False else [node.body, node.orelse]
+            for branch in branches:
+                for child in branch:
+                    visit(child, args)
+            return
+
+        if isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            modules.append(node.module)
+        elif (isinstance(node, ast.Call) and isinstance(node.func, ast.Name)
+              and node.func.id in functions and node.func.id not in visited):
+            helper = functions[node.func.id]
+            visited.add(helper.name)
+            visit(helper, _call_args(node, helper, args))
+
+        for child in ast.iter_child_nodes(node):
+            visit(child, args)
+
+    for node in entry.body:
+        visit(node, args)
+    return list(dict.fromkeys(modules))
+
+
+def stage_runs():
+    """
+    (label, modules) for every stage with its defaults and with each variant.
+    """
+    runs = []
+    for stage in STAGE_FUNCTIONS:
+        runs.append((f"stage {stage}", stage_modules(stage)))
+        for options in STAGE_VARIANTS.get(stage, []):
+            label = " ".join(f"{key}={value}" for key, value in options.items())
+            runs.append((f"stage {stage} {label}", stage_modules(stage, **options)))
+    return runs
+
+
+def run_timed(argv, report_inner=True):
+    """
+    Run a fresh interpreter with `argv`. Returns (wall seconds, in-process seconds or None, error).
+
+    When report_inner is set, the last stdout line is read as the in-process import time.
+    """
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable] + argv,
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True,
+    )
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        last_line = (proc.stderr.strip().splitlines() or ["failed"])[-1]
+        return wall, None, last_line
+    inner = proc.stdout.strip().splitlines()
+    if not report_inner or not inner:
+        return wall, None, None
+    return wall, float(inner[-1]), None
+
+
+def measure(label, argv, repeat, report_inner=True):
+    walls, inners = [], []
+    for _ in range(repeat):
+        wall, inner, error = run_timed(argv, report_inner)
+        if error:
+            print(f"{label:<34} ❌ {error}")
+            return
+        walls.append(wall)
+        if inner is not None:
+            inners.append(inner)
+
+    line = f"{label:<34} wall {statistics.median(walls):7.3f}s"
+    if inners:
+        line += f"   import {statistics.median(inners):7.3f}s"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    timer = "import time; t = time.perf_counter(); {body}; print(time.perf_counter() - t)"
+
+    print(f"🟣 Startup benchmark (median of {args.repeat} fresh interpreters)\n")
+    measure("python -c pass", ["-c", timer.format(body="pass")], args.repeat)
+    measure("import main", ["-c", timer.format(body="import main")], args.repeat)
+    measure("main.py --help", ["main.py", "--help"], args.repeat, report_inner=False)
+
+    import_modules = "import main, importlib; [importlib.import_module(m) for m in %r]"
+    runs = stage_runs()
+    for label, modules in runs:
+        measure(label, ["-c", timer.format(body=import_modules % modules)], args.repeat)
+
+    every_module = sorted({name for _, modules in runs for name in modules})
+    measure(
+        "all stages (eager import)",
+        ["-c", timer.format(body="import importlib; [importlib.import_module(m) for m in %r]" % every_module)],
+        args.repeat,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# Storage/accuracy parity benchmark for the .rhde embedding format
+# For each storage dtype, reports bytes per embedding, reconstruction error
+# against float32, bulk read time, and (if the MLflow model can be loaded)
+# how often predictions on the stored embeddings match float32 predictions.
+#
+# Usage (from the repository root):
+#     python benchmarks/embedding_parity.py [--embeddings data/embeddings] [--model <mlflow model dir>]
+
+import os
+import sys
+import glob
+import time
+import argparse
+import tempfile
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from src.embedding_format import DTYPES, encode_embedding, decode_embedding, write_embedding, read_embeddings
+from src.inference import FEATURE_COLUMNS
+
+DEFAULT_MODEL = os.path.join(REPO_ROOT, "model_downloaded", "red_rhd_model1", "mlflow-model")
+
+
+def load_float32_embeddings(directory):
+    rows = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.npy"))):
+        try:
+            emb = np.load(path, allow_pickle=False)
+        except ValueError:
+            continue
+        emb = np.asarray(emb, dtype=np.float32).squeeze()
+        if emb.ndim >= 1 and emb.shape[-1] == 512:
+            rows.append(emb.reshape(-1, 512))
+    return np.vstack(rows) if rows else np.empty((0, 512), dtype=np.float32)
+
+
+def load_predict_fn(model_dir):
+    import mlflow.pyfunc
+    import pandas as pd
+
+    model = mlflow.pyfunc.load_model(model_dir)
+
+    def predict(X):
+        df = pd.DataFrame(X, columns=FEATURE_COLUMNS)
+        # Fixed IDs so only the features differ between runs
+        df.insert(0, "Patient ID", [f"P{i:05d}" for i in range(len(X))])
+        return np.asarray(model.predict(df))
+
+    return predict
+
+
+def cosine_rows(A, B):
+    num = (A * B).sum(axis=1)
+    den = np.linalg.norm(A, axis=1) * np.linalg.norm(B, axis=1)
+    return num / np.where(den == 0, 1.0, den)
+
+
+def bulk_read_seconds(X, dtype, copies):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        paths = []
+        for i in range(copies):
+            row = X[i % len(X)]
+            if dtype == "npy":
+                path = os.path.join(tmpdir, f"{i}.npy")
+                np.save(path, row)
+            else:
+                path = write_embedding(os.path.join(tmpdir, f"{i}.rhde"), row, dtype)
+            paths.append(path)
+
+        start = time.perf_counter()
+        if dtype == "npy":
+            # What the score stage used to do: one pickle-enabled load per file
+            np.array([np.load(p, allow_pickle=True) for p in paths])
+        else:
+            read_embeddings(paths)
+        return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embedding storage parity benchmark")
+    parser.add_argument("--embeddings", default=os.path.join(REPO_ROOT, "data", "embeddings"))
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--copies", type=int, default=2000, help="Files written for the bulk read timing")
+    args = parser.parse_args()
+
+    X = load_float32_embeddings(args.embeddings)
+    if len(X) == 0:
+        print(f"❌ No float32 .npy embeddings found in {args.embeddings}")
+        sys.exit(1)
+    print(f"🟣 {len(X)} float32 embeddings from {args.embeddings}\n")
+
+    predict = None
+    try:
+        predict = load_predict_fn(args.model)
+        reference = predict(X)
+    except Exception as e:
+        print(f"⚠️ Prediction parity skipped, model could not be loaded: {e}\n")
+
+    npy_bytes = X[0].nbytes + 128  # .npy header
+    print(f"{'format':<9}{'bytes':>7}{'ratio':>7}{'max|err|':>11}{'min cos':>10}{'read s':>9}{'agree':>8}")
+    print(f"{'npy':<9}{npy_bytes:>7}{1.0:>7.2f}{0.0:>11.2e}{1.0:>10.6f}"
+          f"{bulk_read_seconds(X, 'npy', args.copies):>9.3f}{'-':>8}")
+
+    for dtype in DTYPES:
+        blobs = [encode_embedding(row, dtype) for row in X]
+        decoded = np.vstack([decode_embedding(b)[0] for b in blobs])
+        size = int(np.mean([len(b) for b in blobs]))
+
+        agree = "-"
+        if predict is not None:
+            agree = f"{np.mean(predict(decoded) == reference):.1%}"
+
+        print(f"{dtype:<9}{size:>7}{npy_bytes / size:>7.2f}"
+              f"{np.abs(decoded - X).max():>11.2e}{cosine_rows(decoded, X).min():>10.6f}"
+              f"{bulk_read_seconds(X, dtype, args.copies):>9.3f}{agree:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,34 +4,17 @@
 # E-mail: Miguel.Angel.Lopez-Medina@rice.edu
 
 import os
-import pandas as pd
+import sys
+import time
+import glob
 import random
 import string
-import numpy as np
-import json
-import glob
-import mlflow
-from azure.ai.ml import MLClient
-
-from azure.storage.blob import BlobClient, ContainerClient
-
-from src.GC_cardio_to_AzureBlob import transfer_gcs_to_azure
-from src.embedding import extract_embedding
-from src.selector import select_region_profile
-from src.model_loader import load_model_for_region
-from src.blob_utils import download_blob, upload_embedding_to_blob
-from azure_config import get_ml_client
-from src.denoise import denoise_audio
-from src.embedding import convert_embeddings_to_records
-
-
-import joblib
-import matplotlib
-matplotlib.use('Agg')
+import argparse
 import traceback
 
-import requests
-import json
+# Heavy dependencies (pandas, azure, openl3/TensorFlow, noisereduce, ...) are
+# imported inside the stage that needs them, so `python main.py transfer` does
+# not pay for TensorFlow and `python main.py --help` returns immediately.
 
 
 # ---------------------------
@@ -53,6 +36,7 @@ AZURE_SAS_TOKEN = "sp=rcwdl&st=2025-06-09T15:34:27Z&se=2026-01-01T00:34:27Z&spr=
 LOCAL_AUDIO_DIR = "data/audio"
 LOCAL_EMBEDDING_DIR = "data/embeddings"
 LOCAL_DOWNLOADED_EMBEDDINGS_DIR = "data/downloaded_embeddings"
+LOCAL_REJECTED_FILE = "data/rejected_recordings.csv"
 REGION_PROFILE_PATH = "data/region_profiles.json"
 
 # ---------------------------
@@ -74,6 +58,9 @@ MODEL_URI = (
 # Helper to download all embeddings from blob
 # ---------------------------
 def download_all_embeddings(local_dir):
+    from azure.storage.blob import ContainerClient
+    from src.embedding_format import select_embedding_files
+
     print("\n🟣 Downloading all embeddings from Azure Blob Storage...")
     os.makedirs(local_dir, exist_ok=True)
 
@@ -82,14 +69,21 @@ def download_all_embeddings(local_dir):
         credential=AZURE_SAS_TOKEN
     )
 
+    blob_names = [
+        blob.name for blob in container_client.list_blobs(name_starts_with="embeddings/")
+        if blob.name.endswith((".npy", ".rhde"))
+    ]
+    blob_names, superseded = select_embedding_files(blob_names)
+    for blob_name in superseded:
+        print(f"⏭️ Skipping {blob_name}: superseded by its .rhde embedding")
+
     count = 0
-    for blob in container_client.list_blobs(name_starts_with="embeddings/"):
-        if blob.name.endswith(".npy"):
-            local_path = os.path.join(local_dir, os.path.basename(blob.name))
-            with open(local_path, "wb") as f:
-                f.write(container_client.download_blob(blob).readall())
-            print(f"✅ Downloaded: {blob.name} → {local_path}")
-            count += 1
+    for blob_name in blob_names:
+        local_path = os.path.join(local_dir, os.path.basename(blob_name))
+        with open(local_path, "wb") as f:
+            f.write(container_client.download_blob(blob_name).readall())
+        print(f"✅ Downloaded: {blob_name} → {local_path}")
+        count += 1
 
     print(f"✅ Total embeddings downloaded: {count}")
 
@@ -101,15 +95,22 @@ def generate_random_patient_id(length=5):
     return ''.join(random.choices(string.ascii_uppercase + string.digits, k=length))
 
 
-# ---------------------------
-# Main pipeline
-# ---------------------------
-def run_pipeline():
-    print("\n🚀 Starting RED-RHD Pipeline...")
+def list_local_audio(audio_dir=LOCAL_AUDIO_DIR):
+    """
+    Raw .wav recordings already downloaded to audio_dir (denoised copies excluded).
+    """
+    return sorted(
+        path for path in glob.glob(os.path.join(audio_dir, "*.wav"))
+        if not path.endswith("_denoised.wav")
+    )
+
+
+# ------------------------------------------
+# STEP 0: Collect data from GCP → Azure Blob
+# ------------------------------------------
+def transfer_stage():
+    from src.GC_cardio_to_AzureBlob import transfer_gcs_to_azure
 
-    # ------------------------------------------
-    # STEP 0: Collect data from GCP → Azure Blob
-    # ------------------------------------------
     print("\n🟣 Transferring data from GCP to Azure Blob Storage...")
     transfer_gcs_to_azure(
         gcp_credentials_file,
@@ -119,215 +120,710 @@ def run_pipeline():
         AZURE_SAS_TOKEN
     )
 
-    # ------------------------------------------
-    # STEP 1: Download audio recordings
-    # ------------------------------------------
+
+# ------------------------------------------
+# STEP 1: Download audio recordings
+# ------------------------------------------
+def download_stage(only_new=False):
+    from src.blob_utils import download_blob
+    from src.run_manifest import RunManifest
+
     print("\n🟣 Downloading audio files from Azure Blob...")
-    downloaded_files = download_blob(BLOB_URL, LOCAL_AUDIO_DIR, AZURE_SAS_TOKEN)
+    manifest = RunManifest()
+    downloaded_files = download_blob(
+        BLOB_URL, LOCAL_AUDIO_DIR, AZURE_SAS_TOKEN,
+        manifest=manifest, only_new=only_new
+    )
 
     print(f"✅ Total audio files downloaded: {len(downloaded_files)}")
     for f in downloaded_files:
         print(f"📁 {f}")
 
-    # ------------------------------------------
-    # STEP 2: Connect to Azure ML Workspace
-    # ------------------------------------------
-    print("\n🟣 Connecting to Azure ML...")
-    ml_client = get_ml_client(SUBSCRIPTION_ID, RESOURCE_GROUP, WORKSPACE_NAME)
+    return downloaded_files
 
-    # ------------------------------------------
-    # STEP 3: Make local embeddings directory
-    # ------------------------------------------
-    os.makedirs(LOCAL_EMBEDDING_DIR, exist_ok=True)
 
-    # ------------------------------------------
-    # STEP 4: Process each audio file
-    # ------------------------------------------
-    for audio_file in downloaded_files:
-        print(f"\n🎧 Processing: {audio_file}")
+# ------------------------------------------
+# STEP 2: Denoise, embed and upload each audio file
+# ------------------------------------------
+# Recorded in the run manifest; changing them makes the stage run again.
+DENOISE_PARAMS = {"method": "noisereduce", "prop_decrease": 1.0}
+EMBEDDING_PARAMS = {"input_repr": "mel256", "content_type": "env", "embedding_size": 512, "sr": 48000,
+                    "hop_size": 0.1, "pooling": "mean"}
 
-        # Optional: apply denoising before embedding
-        denoised_file = denoise_audio(audio_file)
 
-        # Extract embedding
-        embedding = extract_embedding(denoised_file)
+# "npy" keeps the legacy float32 .npy files; the others write .rhde files
+EMBEDDING_FORMATS = ("float16", "int8", "float32", "npy")
+DEFAULT_EMBEDDING_FORMAT = "float16"
 
-        # Save locally
-        embedding_filename = os.path.basename(audio_file).replace(".wav", "_embedding.npy")
-        local_embedding_path = os.path.join(LOCAL_EMBEDDING_DIR, embedding_filename)
-        np.save(local_embedding_path, embedding)
-        print(f"💾 Saved embedding locally: {local_embedding_path}")
+# Bits kept per value; an embedding can be rewritten in a format at most this precise
+EMBEDDING_FORMAT_BITS = {"int8": 8, "float16": 16, "float32": 32, "npy": 32}
 
-        # Upload to Azure Blob Storage
-        blob_path = f"embeddings/{embedding_filename}"
-        blob_client = BlobClient.from_blob_url(
-            blob_url=f"{BLOB_URL}/{blob_path}",
-            credential=AZURE_SAS_TOKEN
-        )
 
-        with open(local_embedding_path, "rb") as data:
-            blob_client.upload_blob(data, overwrite=True)
-        print(f"⬆️ Uploaded embedding to Azure Blob: {blob_path}")
+def embedding_path_for(audio_file, embedding_format=DEFAULT_EMBEDDING_FORMAT):
+    extension = ".npy" if embedding_format == "npy" else ".rhde"
+    embedding_filename = os.path.basename(audio_file).replace(".wav", f"_embedding{extension}")
+    return os.path.join(LOCAL_EMBEDDING_DIR, embedding_filename)
 
-    print("\n✅ Upload phase completed successfully.")
 
-    # ------------------------------------------
-    # STEP 5: Inference Phase via Azure Endpoint
-    # ------------------------------------------
-    print("\n🚀 Starting Inference Phase...")
+def save_embedding(path, embedding, embedding_format, params):
+    import numpy as np
+    from src.embedding_format import write_embedding
 
-    LOCAL_DOWNLOADED_EMBEDDINGS_DIR = "data/downloaded_embeddings"
-    embedding_files = glob.glob(os.path.join(LOCAL_DOWNLOADED_EMBEDDINGS_DIR, "*.npy"))
-    X = []
-    valid_files = []
+    if embedding_format == "npy":
+        np.save(path, np.asarray(embedding, dtype=np.float32))
+    else:
+        write_embedding(path, embedding, dtype=embedding_format, params=params)
 
-    if not embedding_files:
-        print(f"❌ No embedding .npy files found in {LOCAL_DOWNLOADED_EMBEDDINGS_DIR}. Exiting.")
-        exit(1)
 
-    for path in embedding_files:
+def stored_embedding_format(path):
+    from src.embedding_format import EXTENSION, read_header
+
+    return read_header(path)["dtype"] if path.endswith(EXTENSION) else "npy"
+
+
+def convert_embedding(path, new_path, embedding_format, params):
+    """
+    Rewrite an existing embedding file in another storage format instead of
+    embedding the recording again.
+
+    Returns:
+        bool: False (and nothing written) if the stored values are less precise
+        than `embedding_format`, so only re-embedding can produce it.
+    """
+    import numpy as np
+    from src.embedding_format import EXTENSION, read_embedding
+
+    stored_format = stored_embedding_format(path)
+    if EMBEDDING_FORMAT_BITS[stored_format] < EMBEDDING_FORMAT_BITS[embedding_format]:
+        return False
+
+    if path.endswith(EXTENSION):
+        embedding, _ = read_embedding(path)
+    else:
+        embedding = np.load(path, allow_pickle=False)
+    save_embedding(new_path, embedding, embedding_format, params)
+    if new_path != path:
+        # Otherwise scoring would pick whichever of the two select_embedding_files prefers
+        os.remove(path)
+    print(f"🔁 Converted {path} ({stored_format}) → {new_path} ({embedding_format})")
+    return True
+
+
+def denoise_locally(audio_file, manifest, audio_hash):
+    """
+    Path of the denoised copy of `audio_file`, denoising it unless the manifest has it.
+    """
+    from src.denoise import denoise_audio
+    from src.run_manifest import recording_id
+
+    recording = recording_id(audio_file)
+    if manifest.is_complete(recording, "denoised", audio_hash, DENOISE_PARAMS):
+        # The dask backend records the stage without a file (it denoises in memory)
+        denoised_file = manifest.get(recording, "denoised")["artifact"]
+        if denoised_file and os.path.exists(denoised_file):
+            print(f"⏭️ Denoised file up to date: {denoised_file}")
+            return denoised_file
+
+    denoised_file = denoise_audio(audio_file)
+    manifest.record(recording, "denoised", audio_hash, DENOISE_PARAMS, artifact=denoised_file)
+    return denoised_file
+
+
+def embed_locally(audio_files, manifest, audio_hashes, hop_size=EMBEDDING_PARAMS["hop_size"],
+                  pooling=EMBEDDING_PARAMS["pooling"], frontend_cache=False):
+    """
+    Denoise and embed recordings one by one in this process, reusing one OpenL3 model.
+    Yields (audio_file, embedding, error) like src.dask_backend.embed_with_dask.
+
+    With frontend_cache, each recording's mel spectrogram is cached under
+    data/frontend_cache, so re-embedding with another hop size or pooling skips
+    decoding, denoising and the spectrogram.
+    """
+    from src.embedding import (OPENL3_SR, OPENL3_PARAMS, extract_embedding, embed_mel_windows,
+                               load_openl3_model)
+    from src.run_manifest import recording_id
+
+    cache = None
+    if frontend_cache:
+        from src.frontend_cache import FrontendCache
+        cache = FrontendCache()
+
+    model = None
+    for audio_file in audio_files:
+        recording = recording_id(audio_file)
+        audio_hash = audio_hashes[audio_file]
+        print(f"\n🎧 Processing: {audio_file}")
         try:
-            emb = np.load(path, allow_pickle=True).squeeze()
+            if cache is None:
+                # Optional: apply denoising before embedding
+                denoised_file = denoise_locally(audio_file, manifest, audio_hash)
+
+                if model is None:
+                    model = load_openl3_model(**OPENL3_PARAMS)
+
+                # Extract embedding
+                yield audio_file, extract_embedding(denoised_file, model=model, hop_size=hop_size,
+                                                    pooling=pooling), None
+                continue
+
+            def load_audio():
+                import librosa
+                denoised_file = denoise_locally(audio_file, manifest, audio_hash)
+                return librosa.load(denoised_file, sr=OPENL3_SR)[0]
+
+            mel, n_samples = cache.get_or_compute(recording, cache.key(audio_hash, DENOISE_PARAMS), load_audio)
+
+            if model is None:
+                # The spectrogram comes from the cache, so skip the model's own frontend
+                model = load_openl3_model(**OPENL3_PARAMS, frontend="librosa")
+
+            yield audio_file, embed_mel_windows(mel, n_samples, model, hop_size, pooling), None
         except Exception as e:
-            print(f"❌ ERROR loading {path}: {e}")
-            continue
+            yield audio_file, None, e
+
+
+def write_rejected_list(rejected, path=LOCAL_REJECTED_FILE):
+    """
+    Write this run's quality-gate rejections as CSV: file, recording, reasons, metrics.
+    """
+    import csv
+    import json
+
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["file", "recording", "reasons", "metrics"])
+        for audio_file, recording, reasons, metrics in rejected:
+            writer.writerow([audio_file, recording, "; ".join(reasons), json.dumps(metrics)])
+
+
+def embed_stage(audio_files=None, only_new=False, backend="local", scheduler=None, n_workers=None,
+                quality_config=None, quality_gate=True, embedding_format=DEFAULT_EMBEDDING_FORMAT,
+                hop_size=None, pooling=None, frontend_cache=False):
+    from src.async_upload import AsyncBlobUploader
+    from src.run_manifest import RunManifest, REJECTED, recording_id, file_hash
+    from src.quality import QUALITY_CONFIG_PATH, load_quality_thresholds, assess_file
+    from src.embedding import validate_pooling
+
+    if audio_files is None:
+        audio_files = list_local_audio()
+
+    if hop_size is None:
+        hop_size = EMBEDDING_PARAMS["hop_size"]
+    if hop_size <= 0:
+        raise ValueError(f"hop_size must be positive, got {hop_size}")
+    pooling = validate_pooling(EMBEDDING_PARAMS["pooling"] if pooling is None else pooling)
+    if frontend_cache and backend == "dask":
+        print("⚠️ The frontend cache is local to this machine; the dask backend ignores it.")
+        frontend_cache = False
 
-        if emb.ndim == 0:
-            print(f"⚠️ Skipping {path}: scalar value detected (shape={emb.shape})")
+    os.makedirs(LOCAL_EMBEDDING_DIR, exist_ok=True)
+    manifest = RunManifest()
+    # Stored in each embedding's header and in the manifest. The storage format
+    # is not: switching it converts existing files rather than re-embedding.
+    embedding_params = dict(EMBEDDING_PARAMS, hop_size=hop_size, pooling=pooling)
+    if frontend_cache:
+        embedding_params["frontend"] = "cached-mel"
+
+    # Embeddings upload in the background while the next recordings are embedded
+    uploader = AsyncBlobUploader(BLOB_URL, AZURE_SAS_TOKEN)
+    uploads = []  # (future, recording, embedding hash, blob path)
+
+    def upload_embedding(audio_file):
+        recording = recording_id(audio_file)
+        local_embedding_path = embedding_path_for(audio_file, embedding_format)
+        embedding_hash = file_hash(local_embedding_path)
+        blob_path = f"embeddings/{os.path.basename(local_embedding_path)}"
+        if manifest.is_complete(recording, "uploaded", embedding_hash):
+            print(f"⏭️ Already uploaded: {blob_path}")
+            return
+
+        uploads.append((uploader.submit(local_embedding_path, blob_path), recording, embedding_hash, blob_path))
+
+    def record_uploads(wait=False):
+        # The manifest's SQLite connection belongs to this thread, so finished
+        # uploads are recorded here rather than on the uploader's thread
+        if wait:
+            uploader.flush()
+        still_running = []
+        for upload in uploads:
+            future, recording, embedding_hash, blob_path = upload
+            if not future.done():
+                still_running.append(upload)
+            elif future.exception() is not None:
+                print(f"❌ ERROR uploading {blob_path}: {future.exception()}")
+            else:
+                manifest.record(recording, "uploaded", embedding_hash)
+        uploads[:] = still_running
+
+    thresholds = load_quality_thresholds(quality_config or QUALITY_CONFIG_PATH) if quality_gate else None
+    rejected = []
+
+    # Work out which recordings still need an embedding
+    audio_hashes = {}
+    for audio_file in audio_files:
+        recording = recording_id(audio_file)
+        if only_new and manifest.get(recording, "scored") is not None:
+            print(f"⏭️ Already scored, skipping: {audio_file}")
             continue
 
-        if emb.shape[-1] != 512:
-            print(f"⚠️ Skipping {path}: invalid shape {emb.shape} (expected last dim=512)")
+        audio_hash = file_hash(audio_file)
+        if manifest.is_complete(recording, "embedded", audio_hash, embedding_params):
+            stored_path = manifest.get(recording, "embedded")["artifact"]
+            local_embedding_path = embedding_path_for(audio_file, embedding_format)
+            up_to_date = (stored_path == local_embedding_path
+                          and stored_embedding_format(stored_path) == embedding_format)
+            if not up_to_date and convert_embedding(stored_path, local_embedding_path,
+                                                    embedding_format, embedding_params):
+                manifest.record(recording, "embedded", audio_hash, embedding_params,
+                                artifact=local_embedding_path)
+                up_to_date = True
+
+            if up_to_date:
+                print(f"⏭️ Embedding up to date: {local_embedding_path}")
+                upload_embedding(audio_file)
+                continue
+            print(f"🔁 Stored embedding is coarser than {embedding_format}, embedding again: {stored_path}")
+
+        # Quality gate: skip recordings the model cannot classify meaningfully
+        if thresholds is not None:
+            row = manifest.get(recording, REJECTED)
+            if row and row["content_hash"] == audio_hash and row["params"]["thresholds"] == thresholds:
+                reasons, metrics = row["params"]["reasons"], row["params"]["metrics"]
+            else:
+                metrics, reasons = assess_file(audio_file, thresholds)
+                if reasons:
+                    manifest.record(recording, REJECTED, audio_hash,
+                                    {"thresholds": thresholds, "reasons": reasons, "metrics": metrics})
+                elif row:
+                    manifest.forget(recording, REJECTED)
+
+            if reasons:
+                print(f"🚫 Rejected {audio_file}: {'; '.join(reasons)}")
+                rejected.append((audio_file, recording, reasons, metrics))
+                continue
+
+        audio_hashes[audio_file] = audio_hash
+
+    if thresholds is not None:
+        write_rejected_list(rejected)
+        print(f"\n🟣 Quality gate: {len(rejected)} recordings rejected (see {LOCAL_REJECTED_FILE})")
+
+    to_embed = list(audio_hashes)
+    print(f"\n🟣 Embedding {len(to_embed)} recordings with the {backend} backend...")
+
+    if backend == "dask":
+        from src.dask_backend import embed_with_dask
+        results = embed_with_dask(to_embed, scheduler_address=scheduler, n_workers=n_workers,
+                                  hop_size=hop_size, pooling=pooling)
+    else:
+        results = embed_locally(to_embed, manifest, audio_hashes, hop_size, pooling, frontend_cache)
+
+    failed = []
+    for audio_file, embedding, error in results:
+        if error is not None:
+            print(f"❌ ERROR embedding {audio_file}: {error}")
+            failed.append(audio_file)
             continue
 
-        emb = emb.reshape(-1, 512)
-        for row in emb:
-            X.append(row)
-            valid_files.append(path)
-
-    X = np.array(X)
-
-    if len(X) == 0:
-        print("❌ No valid embeddings to predict. Exiting.")
-        exit(1)
+        recording = recording_id(audio_file)
+        if backend == "dask":
+            # Workers denoise in memory, so there is no denoised file to point to
+            manifest.record(recording, "denoised", audio_hashes[audio_file], DENOISE_PARAMS)
 
-    print(f"✅ Loaded {len(X)} embeddings for prediction.")
+        # Save locally
+        local_embedding_path = embedding_path_for(audio_file, embedding_format)
+        save_embedding(local_embedding_path, embedding, embedding_format, embedding_params)
+        manifest.record(recording, "embedded", audio_hashes[audio_file], embedding_params,
+                        artifact=local_embedding_path)
+        print(f"💾 Saved embedding locally: {local_embedding_path}")
 
-    # ------------------------------------------
-    # 5.2 Convert embeddings to DataFrame
-    # ------------------------------------------
-    print("\n🟣 Converting embeddings to inference DataFrame...")
+        # Upload to Azure Blob Storage
+        upload_embedding(audio_file)
+        record_uploads()
 
-    try:
-        records = convert_embeddings_to_records(X)
-        df_inference = pd.DataFrame(records)
+    record_uploads(wait=True)
+    uploader.close()
 
-        # Cast features to float32
-        feature_cols = [col for col in df_inference.columns if col.startswith('openl3_feature_')]
-        df_inference[feature_cols] = df_inference[feature_cols].astype('float32')
+    if failed:
+        print(f"\n⚠️ {len(failed)} recordings failed and will be retried on the next run.")
+    print("\n✅ Upload phase completed successfully.")
 
-        print("✅ DataFrame ready for prediction:")
-        print(df_inference.head())
 
-    except Exception as e:
-        print(f"❌ ERROR during DataFrame preparation: {e}")
-        traceback.print_exc()
-        exit(1)
+# ------------------------------------------
+# STEP 3: Inference Phase via Azure Endpoint
+# ------------------------------------------
+AZURE_ENDPOINT_URI = "https://ep-red-rhd-model1.eastus2.inference.ml.azure.com/score"
+AZURE_ENDPOINT_KEY = "AZISPKUHZQ267shHdC8DQfUwo7IrvfE5z9HaOflRe10JW0OJSMtpJQQJ99BGAAAAAAAAAAAAINFRAZML1FTS"
+LOCAL_PREDICTIONS_FILE = "predictions_results.csv"
 
-    # ------------------------------------------
-    # 5.3 Call Azure ML Online Endpoint
-    # ------------------------------------------
-    print("\n🟣 Calling Azure ML Online Endpoint for scoring...")
 
-    AZURE_ENDPOINT_URI = "https://ep-red-rhd-model1.eastus2.inference.ml.azure.com/score"
-    AZURE_ENDPOINT_KEY = "AZISPKUHZQ267shHdC8DQfUwo7IrvfE5z9HaOflRe10JW0OJSMtpJQQJ99BGAAAAAAAAAAAAINFRAZML1FTS"
+def call_azure_endpoint(df, endpoint_uri, api_key):
+    import requests
+    import json
 
-    def call_azure_endpoint(df, endpoint_uri, api_key):
-        import requests
-        import json
+    # ✅ Correct Azure ML format expected by your endpoint
+    payload = {
+        "input_data": df.to_dict(orient="split")
+    }
 
-        # ✅ Correct Azure ML format expected by your endpoint
-        payload = {
-            "input_data": df.to_dict(orient="split")
-        }
+    # Optional debug
+    print("\n🟣 Payload preview:")
+    print(json.dumps(payload)[:500] + " ...")
 
-        # Optional debug
-        print("\n🟣 Payload preview:")
-        print(json.dumps(payload)[:500] + " ...")
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {api_key}"
+    }
 
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}"
-        }
+    print("\n🟣 Sending request to Azure endpoint...")
+    response = requests.post(endpoint_uri, headers=headers, json=payload)
 
-        print("\n🟣 Sending request to Azure endpoint...")
-        response = requests.post(endpoint_uri, headers=headers, json=payload)
+    if response.status_code != 200:
+        print(f"❌ ERROR: Azure endpoint returned status {response.status_code}")
+        print(response.text)
+        sys.exit(1)
 
-        if response.status_code != 200:
-            print(f"❌ ERROR: Azure endpoint returned status {response.status_code}")
-            print(response.text)
-            exit(1)
+    return response.json()
 
-        return response.json()
 
+def score_embedding_chunk(df_inference):
+    """
+    Score one chunk on the Azure ML Online Endpoint and return its predictions.
+    """
     try:
         predictions_response = call_azure_endpoint(df_inference, AZURE_ENDPOINT_URI, AZURE_ENDPOINT_KEY)
 
         # Handle Azure typical response format
         if isinstance(predictions_response, dict) and "predictions" in predictions_response:
-            predictions = predictions_response["predictions"]
-        else:
-            predictions = predictions_response
-
-        print("\n✅ Prediction step completed successfully.")
+            return predictions_response["predictions"]
+        return predictions_response
 
     except Exception as e:
         print(f"❌ ERROR during endpoint call: {e}")
         traceback.print_exc()
-        exit(1)
+        sys.exit(1)
 
-    # ------------------------------------------
-    # 5.4 Print results
-    # ------------------------------------------
-    print("\n✅ Predictions:")
-    for fname, pred in zip(valid_files, predictions):
-        print(f"📈 {os.path.basename(fname)} → predicted: {pred}")
 
-    print("\n✅ Inference Phase completed successfully.")
+def score_stage(only_new=False, chunk_size=None, dedup_threshold=None, routing="endpoint"):
+    import numpy as np
+    import pandas as pd
+    from src.inference import DEFAULT_CHUNK_SIZE, iter_embedding_chunks, build_inference_frame
+    from src.results_store import new_run_id, append_predictions, latest_predictions
+    from src.run_manifest import RunManifest, UNREADABLE, recording_id, file_hash
+    from src.similarity import EmbeddingIndex, DUPLICATE_THRESHOLD
+    from src.embedding_format import select_embedding_files
+
+    print("\n🚀 Starting Inference Phase...")
+
+    embedding_files, superseded = select_embedding_files(
+        glob.glob(os.path.join(LOCAL_DOWNLOADED_EMBEDDINGS_DIR, "*.npy"))
+        + glob.glob(os.path.join(LOCAL_DOWNLOADED_EMBEDDINGS_DIR, "*.rhde"))
+    )
+    for path in superseded:
+        print(f"⏭️ Skipping {path}: superseded by its .rhde embedding")
+
+    if not embedding_files:
+        print(f"❌ No embedding .npy/.rhde files found in {LOCAL_DOWNLOADED_EMBEDDINGS_DIR}. Exiting.")
+        sys.exit(1)
+
+    manifest = RunManifest()
+    score_params = {"endpoint": AZURE_ENDPOINT_URI}
+    embedding_hashes = {}
+
+    router = None
+    if routing == "region":
+        import json
+        from azure_config import get_ml_client
+        from src.model_loader import load_model_for_region
+        from src.routing import RegionRouter
+
+        print(f"\n🟣 Routing embeddings by region profiles in {REGION_PROFILE_PATH}...")
+        with open(REGION_PROFILE_PATH, "r") as f:
+            region_profiles = json.load(f)
+
+        ml_client = get_ml_client(SUBSCRIPTION_ID, RESOURCE_GROUP, WORKSPACE_NAME)
+        router = RegionRouter(region_profiles, lambda region: load_model_for_region(region, ml_client))
+        score_params = {"routing": "region", "profiles": file_hash(REGION_PROFILE_PATH)}
+
+    already_scored = 0
+    for path in embedding_files:
+        recording = recording_id(path)
+        if only_new and manifest.get(recording, "scored") is not None:
+            already_scored += 1
+            continue
+
+        embedding_hash = file_hash(path)
+        if manifest.is_complete(recording, "scored", embedding_hash, score_params):
+            print(f"⏭️ Already scored: {path}")
+            already_scored += 1
+            continue
+        if manifest.is_complete(recording, UNREADABLE, embedding_hash):
+            print(f"⏭️ Skipping {path}: could not be loaded last time and has not changed")
+            continue
+        embedding_hashes[path] = embedding_hash
+
+    if not embedding_hashes and already_scored:
+        print("✅ Every embedding is already scored, nothing to do.")
+        return None
 
     # ------------------------------------------
-    # 5.5 Upload predictions to Azure Blob
+    # 3.2 Stream embeddings in bounded chunks and score each one
     # ------------------------------------------
+    chunk_size = chunk_size or DEFAULT_CHUNK_SIZE
+    print(f"\n🟣 Scoring {len(embedding_hashes)} embedding files in chunks of {chunk_size} rows...")
+
+    run_id = new_run_id()
+    total_rows = 0
+    reused_rows = 0
+
+    # Index of every embedding scored so far, used to skip rescoring near-duplicates
+    index = EmbeddingIndex.load_or_create()
+    if dedup_threshold is None:
+        dedup_threshold = DUPLICATE_THRESHOLD
+    dedup = dedup_threshold <= 1.0
+
+    # Latest prediction per recording, read once per run and kept current as
+    # chunks are scored. Only predictions made the same way (endpoint vs.
+    # region models) are reused.
+    known = latest_predictions(None, score_params=score_params) if dedup and len(index) else {}
+
+    def record_unreadable(path):
+        # Remembered by content hash, so the file is retried only once it changes
+        manifest.record(recording_id(path), UNREADABLE, embedding_hashes[path])
+
+    chunks = iter_embedding_chunks(embedding_hashes, chunk_size, on_unreadable=record_unreadable)
+    for block, row_files, completed_files in chunks:
+        row_recordings = [recording_id(f) for f in row_files]
+        predictions = np.empty(len(block), dtype=object)
+        pending = np.ones(len(block), dtype=bool)
+        already_indexed = np.zeros(len(block), dtype=bool)
+
+        # ------------------------------------------
+        # 3.3 Reuse predictions of near-duplicate recordings
+        # ------------------------------------------
+        if len(index) and dedup:
+            matches = index.find_duplicates(block, dedup_threshold)
+            for row, (match, similarity) in enumerate(matches):
+                if match == row_recordings[row]:
+                    # Its own earlier entry: rescore, but don't index it twice
+                    already_indexed[row] = True
+                elif match in known:
+                    predictions[row] = known[match]
+                    pending[row] = False
+                    print(f"♻️ {os.path.basename(row_files[row])} duplicates {match} "
+                          f"(cosine {similarity:.5f}), reusing its prediction")
+            reused_rows += int((~pending).sum())
+
+        if pending.any() and router is not None:
+            chunk_predictions, _ = router.score(block[pending])
+            predictions[pending] = chunk_predictions
+        elif pending.any():
+            df_inference = build_inference_frame(block[pending])
+            if total_rows == 0:
+                print("✅ DataFrame ready for prediction:")
+                print(df_inference.head())
+
+            print("\n🟣 Calling Azure ML Online Endpoint for scoring...")
+            for row, pred in zip(np.flatnonzero(pending), score_embedding_chunk(df_inference)):
+                predictions[row] = pred
+
+        if dedup:
+            known.update((row_recordings[row], str(predictions[row])) for row in np.flatnonzero(pending))
+
+        new_rows = np.flatnonzero(~already_indexed)
+        index.add([row_recordings[row] for row in new_rows], block[new_rows])
+
+        print("\n✅ Predictions:")
+        for fname, pred in zip(row_files, predictions):
+            print(f"📈 {os.path.basename(fname)} → predicted: {pred}")
+
+        # ------------------------------------------
+        # 3.4 Write this chunk's results before reading the next one
+        # ------------------------------------------
+        results_df = pd.DataFrame({
+            "file": [os.path.basename(f) for f in row_files],
+            "prediction": predictions
+        })
+        results_df.to_csv(
+            LOCAL_PREDICTIONS_FILE,
+            mode="w" if total_rows == 0 else "a",
+            header=total_rows == 0,
+            index=False
+        )
+        part_path = append_predictions(results_df, run_id, score_params=score_params)
+        print(f"✅ Appended {len(results_df)} predictions to results store (run_id={run_id}): {part_path}")
+
+        # Only now, with results and the index on disk, count these recordings
+        # as scored, so a rerun never skips a recording the index is missing
+        index.save()
+        for path in completed_files:
+            manifest.record(recording_id(path), "scored", embedding_hashes[path], score_params)
+
+        total_rows += len(block)
+
+    if total_rows == 0 and already_scored:
+        print("✅ No new embeddings could be scored; every loadable one is already scored.")
+        return None
+    if total_rows == 0:
+        print("❌ No valid embeddings to predict. Exiting.")
+        sys.exit(1)
+
+    if reused_rows:
+        print(f"♻️ Reused predictions for {reused_rows} near-duplicate embeddings.")
+
+    print(f"\n✅ Inference Phase completed successfully: {total_rows} embeddings scored.")
+    print(f"✅ Saved local predictions file: {LOCAL_PREDICTIONS_FILE}")
+
+    return run_id
+
+
+# ------------------------------------------
+# STEP 4: Upload predictions to Azure Blob
+# ------------------------------------------
+def publish_stage(run_id=None):
+    from src.async_upload import AsyncBlobUploader
+    from src.results_store import list_part_files, list_run_files, blob_path_for
+    from src.similarity import LOCAL_INDEX_PATH, BLOB_INDEX_PATH
+
     print("\n🟣 Storing predictions to Azure Blob Storage...")
 
-    # Prepare a DataFrame to save
-    results_df = pd.DataFrame({
-        "file": [os.path.basename(f) for f in valid_files],
-        "prediction": predictions
-    })
-
-    # Choose output filename
-    local_predictions_file = "predictions_results.csv"
-    results_df.to_csv(local_predictions_file, index=False)
-    print(f"✅ Saved local predictions file: {local_predictions_file}")
-
-    # Upload to Azure Blob
-    blob_predictions_path = f"predictions/{local_predictions_file}"
-    blob_client = BlobClient.from_blob_url(
-        blob_url=f"{BLOB_URL}/{blob_predictions_path}",
-        credential=AZURE_SAS_TOKEN
-    )
+    if not os.path.exists(LOCAL_PREDICTIONS_FILE):
+        print(f"⚠️ {LOCAL_PREDICTIONS_FILE} not found, run the score stage first.")
+        return
 
-    with open(local_predictions_file, "rb") as data:
-        blob_client.upload_blob(data, overwrite=True)
+    # local path -> blob path
+    uploads = {LOCAL_PREDICTIONS_FILE: f"predictions/{LOCAL_PREDICTIONS_FILE}"}
+    if os.path.exists(LOCAL_INDEX_PATH):
+        uploads[LOCAL_INDEX_PATH] = BLOB_INDEX_PATH
 
-    print(f"⬆️ Uploaded predictions file to Azure Blob Storage: {blob_predictions_path}")
+    # Every local part by default: parts already published are skipped by their
+    # Content-MD5, and runs that were never published (e.g. a failed publish) catch up
+    part_paths = list_part_files() if run_id is None else list_run_files(run_id)
+    if not part_paths:
+        print("⚠️ No results store parts to publish, publishing only the predictions file and index.")
+    for part_path in part_paths:
+        uploads[part_path] = blob_path_for(part_path)
 
+    # Uploaded concurrently; unchanged blobs (same Content-MD5) are skipped
+    with AsyncBlobUploader(BLOB_URL, AZURE_SAS_TOKEN) as uploader:
+        futures = {local_path: uploader.submit(local_path, blob_path) for local_path, blob_path in uploads.items()}
+
+    for local_path, future in futures.items():
+        if future.exception() is not None:
+            print(f"❌ ERROR uploading {local_path}: {future.exception()}")
+
+
+# ---------------------------
+# Main pipeline
+# ---------------------------
+def run_pipeline(only_new=False, dedup_threshold=None):
+    print("\n🚀 Starting RED-RHD Pipeline...")
+
+    transfer_stage()
+    downloaded_files = download_stage(only_new)
+    embed_stage(downloaded_files, only_new)
+    score_stage(only_new, dedup_threshold=dedup_threshold)
+    publish_stage()
+
+
+def timed(stage, func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    print(f"⏱️ {stage} finished in {time.perf_counter() - start:.2f}s")
+    return result
+
+
+def positive_float(value):
+    number = float(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"must be greater than 0, got {value}")
+    return number
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="RED-RHD pipeline")
+    subparsers = parser.add_subparsers(dest="command")
+
+    # Options shared by the stages that consult the run manifest
+    resumable = argparse.ArgumentParser(add_help=False)
+    resumable.add_argument("--only-new", action="store_true",
+                           help="Skip recordings the run manifest already lists as scored")
+    resumable.add_argument("--force", action="store_true",
+                           help="Forget recorded progress and redo every stage (disables prediction reuse)")
+
+    subparsers.add_parser("all", parents=[resumable], help="Run every stage in order (default)")
+    subparsers.add_parser("transfer", help="Copy recordings from GCS to Azure Blob")
+    subparsers.add_parser("download", parents=[resumable], help="Download audio recordings from Azure Blob")
+    embed = subparsers.add_parser("embed", parents=[resumable],
+                                  help=f"Denoise, embed and upload recordings in {LOCAL_AUDIO_DIR}")
+    embed.add_argument("--backend", choices=["local", "dask"], default="local",
+                       help="Embed in this process, or shard recordings across a Dask cluster")
+    embed.add_argument("--scheduler",
+                       help="Dask scheduler address (default: start a LocalCluster)")
+    embed.add_argument("--workers", type=int,
+                       help="Workers for the LocalCluster (default: half the cores, at most 4)")
+    embed.add_argument("--embedding-format", choices=EMBEDDING_FORMATS, default=DEFAULT_EMBEDDING_FORMAT,
+                       help="Storage precision of saved embeddings (.rhde files; 'npy' for legacy float32 .npy)")
+    embed.add_argument("--quality-config",
+                       help="JSON file with quality-gate thresholds (default: config/quality_thresholds.json)")
+    embed.add_argument("--no-quality-gate", action="store_true",
+                       help="Embed every recording, even ones that fail the quality checks")
+    embed.add_argument("--hop-size", type=positive_float,
+                       help="Seconds between OpenL3 frames (default: 0.1); larger is proportionally cheaper")
+    embed.add_argument("--pooling",
+                       help="Pooling over frames: mean (default), max, median, p<q> percentile, "
+                            "or stats (2560 features, not accepted by the scoring model)")
+    embed.add_argument("--frontend-cache", action="store_true",
+                       help="Cache mel spectrograms per recording so changing --hop-size or "
+                            "--pooling skips decode, denoise and spectrogram (local backend)")
+    score = subparsers.add_parser("score", parents=[resumable],
+                                  help=f"Score embeddings in {LOCAL_DOWNLOADED_EMBEDDINGS_DIR}")
+    score.add_argument("--chunk-size", type=int,
+                       help="Embeddings held in memory and sent per endpoint request (default: 256)")
+    score.add_argument("--routing", choices=["endpoint", "region"], default="endpoint",
+                       help="Score with the shared endpoint model, or with per-region models "
+                            f"chosen from {REGION_PROFILE_PATH}")
+    score.add_argument("--dedup-threshold", type=float,
+                       help="Cosine similarity above which a previously scored recording's "
+                            "prediction is reused (default: 0.9995, >1 disables)")
+
+    publish = subparsers.add_parser("publish", help="Upload predictions to Azure Blob")
+    publish.add_argument("--run-id", help="Only publish this results store run (default: every run)")
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    command = args.command or "all"
+    only_new = getattr(args, "only_new", False)
+    dedup_threshold = getattr(args, "dedup_threshold", None)
+
+    if getattr(args, "force", False):
+        from src.run_manifest import RunManifest
+        RunManifest().reset()
+        # A forced rerun must call the models, not reuse stored predictions
+        dedup_threshold = float("inf")
+        print("🟣 Cleared run manifest, every stage will run again.")
+
+    if command == "all":
+        timed("pipeline", run_pipeline, only_new, dedup_threshold)
+    elif command == "transfer":
+        timed(command, transfer_stage)
+    elif command == "download":
+        timed(command, download_stage, only_new)
+    elif command == "embed":
+        timed(command, embed_stage, None, only_new, args.backend, args.scheduler, args.workers,
+              args.quality_config, not args.no_quality_gate, args.embedding_format,
+              args.hop_size, args.pooling, args.frontend_cache)
+    elif command == "score":
+        timed(command, score_stage, only_new, args.chunk_size, dedup_threshold, args.routing)
+    elif command == "publish":
+        timed(command, publish_stage, args.run_id)
 
 
 # ---------------------------
 # Entrypoint
 # ---------------------------
 if __name__ == "__main__":
-    run_pipeline()
-
+    main()
@@ -0,0 +1,225 @@
+# Background bulk uploader for Azure Blob Storage
+# Uploads run on an asyncio event loop in a helper thread, through one shared
+# azure.storage.blob.aio ContainerClient, so the pipeline keeps computing while
+# files go out. Concurrency is bounded by a semaphore, small files are grouped
+# so a burst of them occupies one slot, blobs whose Content-MD5 already matches
+# the local file are skipped, and whatever is queued is flushed before exit.
+
+import os
+import atexit
+import asyncio
+import hashlib
+import threading
+import concurrent.futures
+
+from azure.storage.blob import ContentSettings
+from azure.storage.blob.aio import ContainerClient
+
+DEFAULT_MAX_CONCURRENCY = 8
+
+# Files up to this size are grouped into batches of BATCH_SIZE uploads
+SMALL_OBJECT_BYTES = 256 * 1024
+BATCH_SIZE = 16
+
+# How long a partial batch waits for more small files before it is sent
+BATCH_LINGER_SECONDS = 0.05
+
+UPLOADED = "uploaded"
+SKIPPED = "skipped"
+FAILED = "failed"
+
+
+def _read_with_md5(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    return data, hashlib.md5(data, usedforsecurity=False).digest()
+
+
+class AsyncBlobUploader:
+    """
+    Queue local files for upload to one container and collect the results later.
+
+    Parameters:
+        container_url (str): Container URL, e.g. "https://<account>.blob.core.windows.net/<container>".
+        credential: SAS token string or any credential the aio ContainerClient accepts.
+        max_concurrency (int): Upload tasks in flight at once.
+        skip_unchanged (bool): Compare against the Content-MD5 of the existing blobs
+            (listed once per blob prefix) and skip uploads that would not change them.
+        client_factory (callable, optional): Returns an aio ContainerClient; lets the
+            uploader target an emulator or a fake. Called on the uploader's event loop.
+
+    Use as a context manager, or call close(); anything still queued is also
+    flushed when the interpreter exits.
+    """
+
+    def __init__(self, container_url=None, credential=None, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 skip_unchanged=True, small_object_bytes=SMALL_OBJECT_BYTES, batch_size=BATCH_SIZE,
+                 client_factory=None):
+        if client_factory is None:
+            def client_factory():
+                return ContainerClient.from_container_url(container_url, credential=credential)
+
+        self.max_concurrency = max_concurrency
+        self.skip_unchanged = skip_unchanged
+        self.small_object_bytes = small_object_bytes
+        self.batch_size = batch_size
+
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        self.stats = {UPLOADED: 0, SKIPPED: 0, FAILED: 0}
+        self._closed = False
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="blob-uploader", daemon=True)
+        self._thread.start()
+        self._run(self._setup(client_factory)).result()
+
+        atexit.register(self.close)
+
+    # ---- public API (any thread) ----
+
+    def submit(self, local_path, blob_name):
+        """
+        Queue `local_path` for upload as `blob_name`.
+
+        Returns:
+            concurrent.futures.Future resolving to "uploaded" or "skipped", or
+            raising the upload error.
+        """
+        if self._closed:
+            raise RuntimeError("Uploader is closed")
+
+        future = concurrent.futures.Future()
+        with self._pending_lock:
+            self._pending.add(future)
+        future.add_done_callback(self._discard)
+        self._loop.call_soon_threadsafe(self._enqueue, local_path, blob_name, future)
+        return future
+
+    def flush(self):
+        """
+        Send any partial batch and wait until every queued upload has finished.
+        Errors are not raised here; they stay on the futures returned by submit().
+        """
+        self._loop.call_soon_threadsafe(self._dispatch_batch)
+        with self._pending_lock:
+            pending = list(self._pending)
+        concurrent.futures.wait(pending)
+
+    def close(self):
+        """
+        Flush, close the container client and stop the event loop. Safe to call twice.
+        """
+        if self._closed:
+            return
+        self.flush()
+        self._closed = True
+        self._run(self._client.close()).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        atexit.unregister(self.close)
+        print(f"⬆️ Uploader closed: {self.stats[UPLOADED]} uploaded, {self.stats[SKIPPED]} unchanged, "
+              f"{self.stats[FAILED]} failed")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # ---- event loop side ----
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def _discard(self, future):
+        with self._pending_lock:
+            self._pending.discard(future)
+            self.stats[FAILED if future.exception() else future.result()] += 1
+
+    async def _setup(self, client_factory):
+        self._client = client_factory()
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._remote_md5 = {}      # blob prefix -> {blob name: Content-MD5}
+        self._listing = {}         # blob prefix -> task listing it
+        self._batch = []
+        self._batch_timer = None
+
+    def _enqueue(self, local_path, blob_name, future):
+        try:
+            small = os.path.getsize(local_path) <= self.small_object_bytes
+        except OSError as e:
+            future.set_exception(e)
+            return
+
+        if not small:
+            self._loop.create_task(self._run_slot([(local_path, blob_name, future)]))
+            return
+
+        self._batch.append((local_path, blob_name, future))
+        if len(self._batch) >= self.batch_size:
+            self._dispatch_batch()
+        elif self._batch_timer is None:
+            self._batch_timer = self._loop.call_later(BATCH_LINGER_SECONDS, self._dispatch_batch)
+
+    def _dispatch_batch(self):
+        if self._batch_timer is not None:
+            self._batch_timer.cancel()
+            self._batch_timer = None
+        if self._batch:
+            batch, self._batch = self._batch, []
+            self._loop.create_task(self._run_slot(batch))
+
+    async def _run_slot(self, items):
+        # One semaphore slot per task: a batch of small files is sent back to back
+        async with self._semaphore:
+            for local_path, blob_name, future in items:
+                try:
+                    result = await self._upload(local_path, blob_name)
+                except Exception as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+
+    async def _remote_hashes(self, blob_name):
+        prefix = blob_name.rsplit("/", 1)[0] + "/" if "/" in blob_name else ""
+        if prefix not in self._listing:
+            self._listing[prefix] = self._loop.create_task(self._list_prefix(prefix))
+        await self._listing[prefix]
+        return self._remote_md5[prefix]
+
+    async def _list_prefix(self, prefix):
+        hashes = {}
+        try:
+            async for blob in self._client.list_blobs(name_starts_with=prefix or None):
+                md5 = blob.content_settings.content_md5 if blob.content_settings else None
+                if md5:
+                    hashes[blob.name] = bytes(md5)
+        except Exception as e:
+            # Without a listing nothing can be skipped, but uploads still go ahead
+            print(f"⚠️ Could not list '{prefix}' in Azure Blob, uploading without skip check: {e}")
+            hashes = {}
+        self._remote_md5[prefix] = hashes
+
+    async def _upload(self, local_path, blob_name):
+        # Read on the loop thread: worker threads can no longer be started once
+        # the interpreter is shutting down, which is when the atexit flush runs
+        data, md5 = _read_with_md5(local_path)
+
+        remote = None
+        if self.skip_unchanged:
+            remote = await self._remote_hashes(blob_name)
+            if remote.get(blob_name) == md5:
+                print(f"⏭️ Unchanged in Azure Blob: {blob_name}")
+                return SKIPPED
+
+        await self._client.upload_blob(
+            blob_name, data, overwrite=True,
+            # Stored so the next run can tell the blob is unchanged
+            content_settings=ContentSettings(content_md5=bytearray(md5)),
+        )
+        if remote is not None:
+            remote[blob_name] = md5
+        print(f"⬆️ Uploaded to Azure Blob: {blob_name}")
+        return UPLOADED
@@ -5,7 +5,20 @@ from azure.storage.blob import ContainerClient
 from azure.storage.blob import BlobClient
 import os
 
-def download_blob(blob_url, local_path, sas_token):
+from src.run_manifest import recording_id
+
+
+def blob_content_hash(blob):
+    """
+    Content hash reported by Azure for a listed blob (MD5 if set, else the etag).
+    """
+    md5 = blob.content_settings.content_md5 if blob.content_settings else None
+    if md5:
+        return bytes(md5).hex()
+    return blob.etag.strip('"')
+
+
+def download_blob(blob_url, local_path, sas_token, manifest=None, only_new=False):
     """
     Download all .wav files from an Azure Blob Storage container using a SAS token.
 
@@ -13,9 +26,12 @@ def download_blob(blob_url, local_path, sas_token):
         blob_url (str): Full container URL, e.g., "https://<account>.blob.core.windows.net/<container>"
         local_path (str): Local directory to save downloaded files.
         sas_token (str): Shared Access Signature token (no '?' prefix).
+        manifest (RunManifest, optional): If given, files already downloaded with the
+            same content hash are not fetched again, and new downloads are recorded.
+        only_new (bool): With a manifest, leave out recordings that were already scored.
     
     Returns:
-        List[str]: Paths to downloaded files.
+        List[str]: Paths to downloaded files (including ones already up to date locally).
     """
     container_url = f"{blob_url}?{sas_token}"
     container_client = ContainerClient.from_container_url(container_url)
@@ -25,20 +41,47 @@ def download_blob(blob_url, local_path, sas_token):
 
     for blob in container_client.list_blobs():
         if blob.name.endswith(".wav"):
-            blob_client = container_client.get_blob_client(blob.name)
             local_file_path = os.path.join(local_path, os.path.basename(blob.name))
 
+            if manifest is not None:
+                recording = recording_id(blob.name)
+                content_hash = blob_content_hash(blob)
+
+                if only_new and manifest.get(recording, "scored") is not None:
+                    print(f"⏭️ Already scored, skipping: {blob.name}")
+                    continue
+
+                if manifest.is_complete(recording, "downloaded", content_hash):
+                    print(f"⏭️ Up to date: {blob.name}")
+                    downloaded_files.append(local_file_path)
+                    continue
+
+            blob_client = container_client.get_blob_client(blob.name)
+
             with open(local_file_path, "wb") as f:
                 f.write(blob_client.download_blob().readall())
 
+            if manifest is not None:
+                manifest.record(recording, "downloaded", content_hash, artifact=local_file_path)
+
             print(f"⬇️ Downloaded: {blob.name}")
             downloaded_files.append(local_file_path)
 
     return downloaded_files
 
 
-def upload_embedding_to_blob(local_path, blob_url, sas_token):
+def upload_embedding_to_blob(local_path, blob_url, sas_token, uploader=None):
+    """
+    Upload one embedding file to embeddings/<name> in the container.
+
+    Parameters:
+        uploader (AsyncBlobUploader, optional): If given, the upload is queued on it
+            and its future is returned instead of uploading synchronously.
+    """
     blob_name = f"embeddings/{os.path.basename(local_path)}"
+    if uploader is not None:
+        return uploader.submit(local_path, blob_name)
+
     full_url = f"{blob_url}/{blob_name}?{sas_token}"
     blob_client = BlobClient.from_blob_url(full_url)
     with open(local_path, "rb") as f:
@@ -0,0 +1,209 @@
+# Distributed denoise + embedding backend on Dask
+# Recordings are sharded across the workers of a distributed.LocalCluster (or
+# any scheduler address). Every worker loads OpenL3 once through a worker
+# plugin, embeddings stream back as their futures complete, and recordings
+# stuck on a slow worker are speculatively re-run on another one.
+
+import io
+import os
+import time
+
+import numpy as np
+from distributed import Client, LocalCluster, WorkerPlugin, as_completed, get_worker
+
+from src.denoise import denoise_array
+from src.embedding import (OPENL3_SR, OPENL3_PARAMS, DEFAULT_HOP_SIZE, DEFAULT_POOLING,
+                           load_openl3_model, embed_audio_array)
+
+PLUGIN_NAME = "openl3-model"
+
+# Every worker process holds its own TensorFlow runtime and OpenL3 model, so a
+# LocalCluster defaults to a few workers that split the cores between them
+# rather than one worker per core each spinning up all-core TensorFlow pools.
+MAX_DEFAULT_WORKERS = 4
+
+
+class OpenL3ModelPlugin(WorkerPlugin):
+    """
+    Loads the OpenL3 model when a worker starts and keeps it on the worker.
+
+    Parameters:
+        params (dict, optional): load_openl3_model() arguments.
+        tf_threads (int, optional): TensorFlow intra-op threads per worker; None
+            leaves TensorFlow's default (all cores).
+    """
+
+    def __init__(self, params=None, tf_threads=None):
+        self.params = dict(params or OPENL3_PARAMS)
+        self.tf_threads = tf_threads
+
+    def setup(self, worker):
+        if self.tf_threads:
+            import tensorflow as tf
+            try:
+                # Must happen before TensorFlow creates its thread pools
+                tf.config.threading.set_intra_op_parallelism_threads(self.tf_threads)
+                tf.config.threading.set_inter_op_parallelism_threads(1)
+            except RuntimeError as e:
+                print(f"⚠️ Could not cap TensorFlow threads on {worker.address}: {e}")
+        worker.openl3_model = load_openl3_model(**self.params)
+
+
+def _worker_model():
+    worker = get_worker()
+    model = getattr(worker, "openl3_model", None)
+    if model is None:
+        # Plugin not registered (e.g. worker joined a foreign scheduler late)
+        model = worker.openl3_model = load_openl3_model(**OPENL3_PARAMS)
+    return model
+
+
+def embed_audio_bytes(audio_bytes, hop_size=DEFAULT_HOP_SIZE, pooling=DEFAULT_POOLING):
+    """
+    Decode, denoise and embed one recording given as raw .wav bytes.
+
+    Runs on a Dask worker, so it only relies on data it is sent, not on local paths.
+    """
+    import librosa
+    import soundfile as sf
+
+    y, sr = sf.read(io.BytesIO(audio_bytes), dtype="float32", always_2d=False)
+    if y.ndim > 1:
+        y = y.mean(axis=1)
+
+    y = denoise_array(y, sr)
+    if sr != OPENL3_SR:
+        y = librosa.resample(y, orig_sr=sr, target_sr=OPENL3_SR)
+
+    return embed_audio_array(y, OPENL3_SR, model=_worker_model(), hop_size=hop_size, pooling=pooling)
+
+
+def default_local_workers():
+    return max(1, min(MAX_DEFAULT_WORKERS, (os.cpu_count() or 1) // 2))
+
+
+def _start_client(scheduler_address, n_workers, threads_per_worker):
+    """
+    Returns (client, cluster or None, TensorFlow threads per worker or None).
+    """
+    if scheduler_address:
+        # Remote workers are sized by whoever started them
+        return Client(scheduler_address), None, None
+    n_workers = n_workers or default_local_workers()
+    tf_threads = max(1, (os.cpu_count() or 1) // n_workers)
+    # One Dask thread per worker: the cores go to TensorFlow's pool instead
+    cluster = LocalCluster(n_workers=n_workers, threads_per_worker=threads_per_worker, processes=True)
+    return Client(cluster), cluster, tf_threads
+
+
+def embed_with_dask(audio_files, scheduler_address=None, n_workers=None, threads_per_worker=1,
+                    max_in_flight=None, straggler_factor=3.0, poll_interval=0.5,
+                    hop_size=DEFAULT_HOP_SIZE, pooling=DEFAULT_POOLING):
+    """
+    Denoise and embed recordings on a Dask cluster, yielding results as they finish.
+
+    Parameters:
+        audio_files (list): Local .wav paths; their bytes are shipped to the workers.
+        scheduler_address (str, optional): Existing scheduler, e.g. "tcp://10.0.0.5:8786".
+            If None, a LocalCluster is started and shut down afterwards.
+        n_workers (int, optional): Workers for the LocalCluster (default: half the cores,
+            at most MAX_DEFAULT_WORKERS). The cores are split between the workers'
+            TensorFlow thread pools.
+        threads_per_worker (int): Threads per LocalCluster worker.
+        max_in_flight (int, optional): Recordings submitted but not yet finished
+            (default: twice the number of workers). Bounds client and cluster memory.
+        straggler_factor (float): A recording running longer than this multiple of the
+            median completed duration is duplicated on another worker; the first
+            result wins.
+        poll_interval (float): Seconds between straggler checks while nothing completes.
+        hop_size (float): Seconds between OpenL3 frames.
+        pooling (str): Pooling over frames, see src.embedding.pool_embeddings().
+
+    Yields:
+        (audio_file, embedding or None, error or None) in completion order.
+    """
+    client, cluster, tf_threads = _start_client(scheduler_address, n_workers, threads_per_worker)
+    try:
+        # register_worker_plugin was renamed register_plugin in newer distributed releases
+        register = getattr(client, "register_plugin", None) or client.register_worker_plugin
+        register(OpenL3ModelPlugin(tf_threads=tf_threads), name=PLUGIN_NAME)
+        workers = list(client.scheduler_info()["workers"])
+        print(f"🟣 Dask cluster ready: {len(workers)} workers ({client.dashboard_link})")
+
+        max_in_flight = max_in_flight or 2 * max(len(workers), 1)
+        queue = list(audio_files)
+        queue.reverse()
+
+        futures = as_completed()
+        running = {}      # future -> audio_file
+        started = {}      # audio_file -> submit time
+        attempts = {}     # audio_file -> futures still running for it
+        speculated = set()
+        durations = []
+
+        def submit(audio_file, avoid=()):
+            with open(audio_file, "rb") as f:
+                data = client.scatter(f.read(), hash=False)
+            allowed = [w for w in client.scheduler_info()["workers"] if w not in avoid]
+            future = client.submit(
+                embed_audio_bytes, data, hop_size, pooling, pure=False,
+                workers=allowed if avoid and allowed else None,
+            )
+            running[future] = audio_file
+            attempts.setdefault(audio_file, []).append(future)
+            started.setdefault(audio_file, time.monotonic())
+            futures.add(future)
+
+        while queue or running:
+            while queue and len(attempts) < max_in_flight:
+                submit(queue.pop())
+
+            if not futures.has_ready():
+                time.sleep(poll_interval)
+                _speculate(client, started, attempts, speculated, durations, straggler_factor, submit)
+                continue
+
+            for future in futures.next_batch(block=False):
+                audio_file = running.pop(future, None)
+                if audio_file is None or audio_file not in attempts:
+                    continue  # a duplicate already delivered this recording
+
+                attempts[audio_file].remove(future)
+                if future.status == "error":
+                    if attempts[audio_file]:
+                        continue  # another attempt is still running
+                    del attempts[audio_file]
+                    started.pop(audio_file, None)
+                    yield audio_file, None, future.exception()
+                    continue
+
+                for other in attempts.pop(audio_file):
+                    running.pop(other, None)
+                    other.cancel()
+                durations.append(time.monotonic() - started.pop(audio_file))
+                yield audio_file, np.asarray(future.result()), None
+    finally:
+        client.close()
+        if cluster is not None:
+            cluster.close()
+
+
+def _speculate(client, started, attempts, speculated, durations, straggler_factor, submit):
+    """
+    Re-submit recordings that run much longer than the median on another worker.
+    """
+    if len(durations) < 3:
+        return
+
+    cutoff = straggler_factor * float(np.median(durations))
+    now = time.monotonic()
+    processing = client.processing()
+    for audio_file, audio_futures in list(attempts.items()):
+        if audio_file in speculated or now - started[audio_file] <= cutoff:
+            continue
+        keys = {f.key for f in audio_futures}
+        busy = [w for w, worker_keys in processing.items() if keys & set(worker_keys)]
+        print(f"🐢 Straggler: {audio_file} running {now - started[audio_file]:.1f}s, "
+              f"duplicating away from {busy or 'its worker'}")
+        speculated.add(audio_file)
+        submit(audio_file, avoid=busy)
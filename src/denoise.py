@@ -15,6 +15,21 @@ tasks.
 Internally uses STFT → Noise Spectrum Estimation → Spectral Gating → iSTFT.
 """
 
+def denoise_array(y, sr, prop_decrease=1.0):
+    """
+    Apply spectral noise reduction to an in-memory signal.
+
+    Args:
+        y (np.ndarray): Mono audio samples.
+        sr (int): Sample rate of y.
+        prop_decrease (float): Proportion of the estimated noise to remove.
+
+    Returns:
+        np.ndarray: Denoised samples, same length and sample rate as y.
+    """
+    return nr.reduce_noise(y=y, sr=sr, prop_decrease=prop_decrease)
+
+
 def denoise_audio(input_path, output_path=None):
     """
     Apply spectral noise reduction to an audio file.
@@ -33,7 +48,7 @@ def denoise_audio(input_path, output_path=None):
         print(f"🎧 Loaded audio: {input_path} (Sample Rate: {sr}, Duration: {len(y)/sr:.2f}s)")
 
         # Apply noise reduction
-        reduced_noise = nr.reduce_noise(y=y, sr=sr, prop_decrease=1.0)
+        reduced_noise = denoise_array(y, sr)
         print(f"✨ Noise reduction applied.")
 
         # Determine output path
@@ -1,11 +1,130 @@
-﻿import openl3
-import librosa
-import numpy as np
+﻿import numpy as np
 
 import random
 import string
 
-def extract_embedding(audio_path):
+OPENL3_SR = 48000
+OPENL3_PARAMS = {"input_repr": "mel256", "content_type": "env", "embedding_size": 512}
+
+# Seconds between OpenL3 frames; frame count (and cost) scales with 1 / hop size
+DEFAULT_HOP_SIZE = 0.1
+
+# "p<q>" (e.g. "p90") is also accepted and takes the q-th percentile over time
+POOLING_CHOICES = ("mean", "max", "median", "stats")
+DEFAULT_POOLING = "mean"
+
+# Summaries concatenated by "stats" pooling, giving 5 x 512 features
+STATS_PERCENTILES = (10, 50, 90)
+
+
+def validate_pooling(pooling):
+    """
+    Return `pooling` if it names a supported strategy, else raise ValueError.
+    """
+    if pooling in POOLING_CHOICES:
+        return pooling
+    if pooling.startswith("p") and pooling[1:].isdigit() and 0 <= int(pooling[1:]) <= 100:
+        return pooling
+    raise ValueError(f"Unsupported pooling '{pooling}', expected one of {POOLING_CHOICES} or p0-p100")
+
+
+def pool_embeddings(frames, pooling=DEFAULT_POOLING):
+    """
+    Pool per-frame OpenL3 embeddings (n_frames, d) over time.
+
+    Args:
+        frames (np.ndarray): Frame embeddings, shape (n_frames, d).
+        pooling (str): "mean", "max", "median", "p<q>" for the q-th percentile,
+            or "stats" for [mean, std, p10, p50, p90] concatenated (5 * d values).
+
+    Returns:
+        np.ndarray: Pooled embedding.
+    """
+    validate_pooling(pooling)
+    if pooling == "mean":
+        return np.mean(frames, axis=0)
+    if pooling == "max":
+        return np.max(frames, axis=0)
+    if pooling == "median":
+        return np.median(frames, axis=0)
+    if pooling == "stats":
+        percentiles = np.percentile(frames, STATS_PERCENTILES, axis=0)
+        return np.concatenate([np.mean(frames, axis=0), np.std(frames, axis=0), *percentiles])
+    return np.percentile(frames, int(pooling[1:]), axis=0)
+
+
+def load_openl3_model(input_repr="mel256", content_type="env", embedding_size=512, frontend="kapre"):
+    """
+    Load the OpenL3 audio model once so it can be reused across recordings.
+
+    frontend="librosa" loads the network without its built-in spectrogram layer,
+    for use with embed_mel_windows() on precomputed spectrograms.
+    """
+    # openl3 pulls in TensorFlow; import it only when an embedding is actually needed
+    import openl3
+
+    return openl3.models.load_audio_embedding_model(
+        input_repr=input_repr,
+        content_type=content_type,
+        embedding_size=embedding_size,
+        frontend=frontend
+    )
+
+
+def embed_audio_array(audio, sr, model=None, hop_size=DEFAULT_HOP_SIZE, pooling=DEFAULT_POOLING):
+    """
+    Pooled OpenL3 embedding of an in-memory signal.
+
+    Args:
+        audio (np.ndarray): Mono audio samples.
+        sr (int): Sample rate of audio.
+        model: Preloaded model from load_openl3_model(); loaded on demand if None.
+        hop_size (float): Seconds between OpenL3 frames.
+        pooling (str): Pooling over frames, see pool_embeddings().
+
+    Returns:
+        np.ndarray: Pooled embedding, shape (512,) (or (2560,) for "stats").
+    """
+    import openl3
+
+    if model is None:
+        model = load_openl3_model(**OPENL3_PARAMS)
+
+    embeddings, _ = openl3.get_audio_embedding(audio, sr, model=model, hop_size=hop_size, verbose=False)
+    print(f"   📐 Raw embedding shape: {embeddings.shape}")
+
+    return pool_embeddings(embeddings, pooling)
+
+
+def embed_mel_windows(mel, n_samples, model, hop_size=DEFAULT_HOP_SIZE, pooling=DEFAULT_POOLING,
+                      batch_size=64):
+    """
+    Pooled OpenL3 embedding from a cached whole-recording mel spectrogram.
+
+    Args:
+        mel, n_samples: As returned by src.frontend_cache.compute_mel().
+        model: Model from load_openl3_model(frontend="librosa").
+        hop_size (float): Seconds between OpenL3 frames.
+        pooling (str): Pooling over frames, see pool_embeddings().
+        batch_size (int): Windows materialized and run through the network at once.
+
+    Returns:
+        np.ndarray: Pooled embedding.
+    """
+    from src.frontend_cache import frame_starts, frame_windows
+
+    n_columns = model.input_shape[2]
+    starts = frame_starts(mel, n_samples, hop_size, n_columns)
+    embeddings = np.concatenate([
+        model.predict(frame_windows(mel, starts[i:i + batch_size], n_columns), verbose=0)
+        for i in range(0, len(starts), batch_size)
+    ])
+    print(f"   📐 Raw embedding shape: {embeddings.shape}")
+
+    return pool_embeddings(embeddings, pooling)
+
+
+def extract_embedding(audio_path, model=None, hop_size=DEFAULT_HOP_SIZE, pooling=DEFAULT_POOLING):
     """
     Extract OpenL3 512-dimensional embedding from a heart sound audio file.
     
@@ -13,27 +132,19 @@ def extract_embedding(audio_path):
     - input_repr='mel256'
     - content_type='env'
     - embedding_size=512
-    - mean pooling over time
+    - frames every `hop_size` seconds (default 0.1)
+    - `pooling` over time (default mean)
     """
+    import librosa
+
     print(f"🔎 Extracting OpenL3 embedding from {audio_path}")
 
     # Load audio with high enough sample rate for PCG
-    audio, sr = librosa.load(audio_path, sr=48000)
+    audio, sr = librosa.load(audio_path, sr=OPENL3_SR)
     print(f"   🎼 Loaded audio: sr={sr}, duration={len(audio)/sr:.2f}s")
 
     # Extract OpenL3 embeddings
-    embeddings, _ = openl3.get_audio_embedding(
-        audio,
-        sr,
-        input_repr="mel256",
-        content_type="env",
-        embedding_size=512
-    )
-
-    print(f"   📐 Raw embedding shape: {embeddings.shape}")
-
-    # Mean pool over time axis
-    pooled_embedding = np.mean(embeddings, axis=0)
+    pooled_embedding = embed_audio_array(audio, sr, model=model, hop_size=hop_size, pooling=pooling)
     print(f"   ✅ Pooled embedding shape: {pooled_embedding.shape}")
 
     return pooled_embedding
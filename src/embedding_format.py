@@ -0,0 +1,223 @@
+# Compact, pickle-free embedding file format (.rhde)
+#
+# Layout (little-endian):
+#   4 bytes   magic b"RHDE"
+#   1 byte    format version
+#   4 bytes   header length N (uint32)
+#   N bytes   JSON header: dtype, shape, OpenL3 params, sha256 of the payload
+#   payload   float32 / float16 rows, or for int8 one float32 scale per row
+#             followed by the int8 codes (row ≈ codes * scale)
+#
+# float16 halves and int8 quarters the size of float32 .npy files, and reading
+# never unpickles anything.
+
+import os
+import sys
+import json
+import struct
+import hashlib
+
+import numpy as np
+
+MAGIC = b"RHDE"
+VERSION = 1
+EXTENSION = ".rhde"
+DTYPES = ("float32", "float16", "int8")
+
+_PREAMBLE = struct.Struct("<4sBI")
+
+
+def quantize_rows(X):
+    """
+    int8 codes and per-row float32 scales such that X ≈ codes * scales[:, None].
+    """
+    scales = np.abs(X).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.round(X / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def _encode(X, dtype):
+    if dtype == "float32":
+        return X.astype("<f4").tobytes()
+    if dtype == "float16":
+        return X.astype("<f2").tobytes()
+    if dtype == "int8":
+        codes, scales = quantize_rows(X)
+        return scales.astype("<f4").tobytes() + codes.tobytes()
+    raise ValueError(f"Unsupported dtype '{dtype}', expected one of {DTYPES}")
+
+
+def _decode(payload, dtype, shape, out=None):
+    n, d = shape
+    if out is None:
+        out = np.empty((n, d), dtype=np.float32)
+    if dtype == "float32":
+        out[:] = np.frombuffer(payload, dtype="<f4").reshape(n, d)
+    elif dtype == "float16":
+        out[:] = np.frombuffer(payload, dtype="<f2").reshape(n, d)
+    elif dtype == "int8":
+        scales = np.frombuffer(payload, dtype="<f4", count=n)
+        codes = np.frombuffer(payload, dtype=np.int8, offset=4 * n).reshape(n, d)
+        np.multiply(codes, scales[:, None], out=out)
+    else:
+        raise ValueError(f"Unsupported dtype '{dtype}' in embedding file")
+    return out
+
+
+def encode_embedding(embedding, dtype="float16", params=None):
+    """
+    Serialize an embedding (d,) or (n, d) into .rhde bytes.
+    """
+    X = np.atleast_2d(np.asarray(embedding, dtype=np.float32))
+    payload = _encode(X, dtype)
+    header = json.dumps({
+        "dtype": dtype,
+        "shape": list(X.shape),
+        "params": params or {},
+        "sha256": hashlib.sha256(payload).hexdigest(),
+    }).encode("utf-8")
+    return _PREAMBLE.pack(MAGIC, VERSION, len(header)) + header + payload
+
+
+def write_embedding(path, embedding, dtype="float16", params=None):
+    """
+    Write an embedding to `path` in .rhde format.
+
+    Args:
+        path (str): Output file, conventionally ending in .rhde.
+        embedding (np.ndarray): Shape (d,) or (n, d).
+        dtype (str): "float32", "float16" or "int8" (per-row scale).
+        params (dict, optional): Extraction parameters stored in the header.
+    """
+    with open(path, "wb") as f:
+        f.write(encode_embedding(embedding, dtype, params))
+    return path
+
+
+def _split(data, source="<bytes>"):
+    if len(data) < _PREAMBLE.size:
+        raise ValueError(f"{source}: too short to be an embedding file")
+    magic, version, header_len = _PREAMBLE.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError(f"{source}: not an embedding file (bad magic)")
+    if version > VERSION:
+        raise ValueError(f"{source}: format version {version} is newer than supported ({VERSION})")
+
+    start = _PREAMBLE.size
+    header = json.loads(data[start:start + header_len].decode("utf-8"))
+    payload = data[start + header_len:]
+    if hashlib.sha256(payload).hexdigest() != header["sha256"]:
+        raise ValueError(f"{source}: checksum mismatch, file is corrupt or truncated")
+    return header, payload
+
+
+def read_header(path):
+    """
+    Header dict of an .rhde file (dtype, shape, params, sha256), without decoding rows.
+    """
+    with open(path, "rb") as f:
+        magic, version, header_len = _PREAMBLE.unpack(f.read(_PREAMBLE.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path}: not an embedding file (bad magic)")
+        return json.loads(f.read(header_len).decode("utf-8"))
+
+
+def decode_embedding(data, source="<bytes>"):
+    """
+    Parse .rhde bytes. Returns (float32 array of shape (n, d), header).
+    """
+    header, payload = _split(data, source)
+    return _decode(payload, header["dtype"], header["shape"]), header
+
+
+def read_embedding(path):
+    """
+    Read one .rhde file. Returns (float32 array of shape (n, d), header).
+    """
+    with open(path, "rb") as f:
+        return decode_embedding(f.read(), path)
+
+
+def read_embeddings(paths):
+    """
+    Bulk-read many .rhde files into one preallocated float32 matrix.
+
+    Returns:
+        (X, row_files): X has one row per stored embedding row, and
+        row_files[i] is the file row i came from.
+    """
+    headers = [read_header(path) for path in paths]
+    dims = {h["shape"][1] for h in headers}
+    if len(dims) > 1:
+        raise ValueError(f"Embedding files disagree on dimension: {sorted(dims)}")
+
+    n_rows = sum(h["shape"][0] for h in headers)
+    X = np.empty((n_rows, dims.pop() if dims else 0), dtype=np.float32)
+    row_files = []
+
+    offset = 0
+    for path, header in zip(paths, headers):
+        with open(path, "rb") as f:
+            file_header, payload = _split(f.read(), path)
+        n = file_header["shape"][0]
+        _decode(payload, file_header["dtype"], file_header["shape"], out=X[offset:offset + n])
+        row_files.extend([path] * n)
+        offset += n
+
+    return X, row_files
+
+
+def select_embedding_files(paths):
+    """
+    Keep one embedding file per recording, preferring .rhde over legacy .npy.
+
+    After the switch to .rhde, a recording can have both files (locally or in
+    the container); scoring both would write its prediction twice.
+
+    Returns:
+        (selected, superseded): sorted lists of paths.
+    """
+    from src.run_manifest import recording_id
+
+    chosen = {}
+    for path in sorted(paths):
+        recording = recording_id(path)
+        if recording not in chosen or path.endswith(EXTENSION):
+            chosen[recording] = path
+
+    selected = set(chosen.values())
+    superseded = [path for path in sorted(paths) if path not in selected]
+    return sorted(selected), superseded
+
+
+def convert_npy_files(directory, dtype="float16", params=None, remove=False):
+    """
+    Convert legacy float .npy embeddings in `directory` to .rhde files.
+
+    Pickled (object) .npy files are reported and left alone.
+    """
+    converted = 0
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".npy"):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            embedding = np.load(path, allow_pickle=False)
+        except ValueError:
+            print(f"⚠️ Skipping {path}: pickled .npy files are not converted")
+            continue
+
+        out_path = os.path.splitext(path)[0] + EXTENSION
+        write_embedding(out_path, embedding, dtype, params)
+        print(f"💾 {path} → {out_path}")
+        converted += 1
+        if remove:
+            os.remove(path)
+
+    print(f"✅ Converted {converted} embeddings to {dtype} {EXTENSION} files.")
+
+
+if __name__ == "__main__":
+    # python -m src.embedding_format <directory> [float32|float16|int8]
+    convert_npy_files(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else "float16")
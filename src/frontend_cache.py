@@ -0,0 +1,142 @@
+# Cached mel256 frontend for OpenL3
+# The expensive part of re-embedding a recording with a different hop size or
+# pooling is decoding, denoising and computing its spectrogram, not the network.
+# This module computes the mel256 magnitude spectrogram of the whole (denoised)
+# recording once, caches it on disk per recording, and slices the 1 s OpenL3
+# input windows out of it for any hop size.
+#
+# Windows start on the nearest spectrogram column (5 ms at 48 kHz) to the exact
+# OpenL3 frame offset, and edge columns see the neighbouring audio instead of
+# the per-window padding, so embeddings match the built-in frontend closely
+# but not bit for bit.
+
+import os
+import json
+import hashlib
+
+import numpy as np
+
+LOCAL_FRONTEND_CACHE_DIR = "data/frontend_cache"
+
+# Matches OpenL3's mel256 frontend at its 48 kHz input rate
+MEL_PARAMS = {"sr": 48000, "n_fft": 2048, "hop_length": 242, "n_mels": 256, "htk": True, "power": 1.0}
+DB_AMIN = 1e-10
+DYNAMIC_RANGE = 80.0
+
+
+def compute_mel(audio, params=MEL_PARAMS):
+    """
+    Linear-magnitude mel spectrogram of a whole recording, padded like OpenL3.
+
+    Args:
+        audio (np.ndarray): Mono samples at params["sr"].
+
+    Returns:
+        (mel, n_samples): mel of shape (n_mels, n_columns) as float32, and the
+        padded signal length that OpenL3 would have framed.
+    """
+    import librosa
+
+    sr = params["sr"]
+    # OpenL3 centers its frames by padding half a frame of silence on each side
+    padded = np.pad(np.asarray(audio, dtype=np.float32), sr // 2)
+    if len(padded) < sr:
+        padded = np.pad(padded, (0, sr - len(padded)))
+
+    mel = librosa.feature.melspectrogram(
+        y=padded, sr=sr, n_fft=params["n_fft"], hop_length=params["hop_length"],
+        n_mels=params["n_mels"], htk=params["htk"], power=params["power"],
+    )
+    return mel.astype(np.float32), len(padded)
+
+
+def frame_starts(mel, n_samples, hop_size, n_columns, params=MEL_PARAMS):
+    """
+    First spectrogram column of every OpenL3 frame for `hop_size` seconds.
+    """
+    sr = params["sr"]
+    hop_samples = int(hop_size * sr)
+    n_frames = 1 + int((n_samples - sr) / hop_samples)
+
+    starts = np.round(np.arange(n_frames) * hop_samples / params["hop_length"]).astype(int)
+    return np.clip(starts, 0, mel.shape[1] - n_columns)
+
+
+def frame_windows(mel, starts, n_columns):
+    """
+    OpenL3 input windows beginning at columns `starts` of a cached spectrogram.
+
+    Returns:
+        np.ndarray: (len(starts), n_mels, n_columns, 1) decibel windows, each
+        scaled to 0 dB at its maximum and floored at -DYNAMIC_RANGE like
+        OpenL3's own frontend.
+    """
+    views = np.lib.stride_tricks.sliding_window_view(mel, n_columns, axis=1)
+    windows = np.log10(np.maximum(views[:, starts].transpose(1, 0, 2), DB_AMIN)) * 10.0
+    windows -= windows.max(axis=(1, 2), keepdims=True)
+    np.maximum(windows, -DYNAMIC_RANGE, out=windows)
+    return windows[..., np.newaxis]
+
+
+class FrontendCache:
+    """
+    On-disk cache of whole-recording mel spectrograms, one .npz per recording.
+
+    Entries are keyed by the recording's content hash plus everything that
+    shapes the spectrogram (denoising and mel parameters), so a stale entry
+    is never reused; it is simply overwritten.
+    """
+
+    def __init__(self, directory=LOCAL_FRONTEND_CACHE_DIR, params=MEL_PARAMS):
+        self.directory = directory
+        self.params = dict(params)
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, content_hash, denoise_params=None):
+        blob = json.dumps({"hash": content_hash, "denoise": denoise_params or {}, "mel": self.params},
+                          sort_keys=True, default=str)
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    def path_for(self, recording):
+        return os.path.join(self.directory, f"{recording}_mel.npz")
+
+    def load(self, recording, key):
+        """
+        Cached (mel, n_samples) for `recording`, or None if missing or stale.
+        """
+        path = self.path_for(recording)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                if str(data["key"]) != key:
+                    return None
+                return data["mel"], int(data["n_samples"])
+        except Exception as e:
+            print(f"⚠️ Ignoring unreadable frontend cache {path}: {e}")
+            return None
+
+    def store(self, recording, key, mel, n_samples):
+        with open(self.path_for(recording), "wb") as f:
+            np.savez(f, key=np.str_(key), mel=mel, n_samples=np.int64(n_samples))
+
+    def get_or_compute(self, recording, key, load_audio):
+        """
+        Cached spectrogram of `recording`, computing it from load_audio() on a miss.
+
+        Args:
+            load_audio (callable): Returns the mono, denoised signal at params["sr"].
+                Only called when the cache has no valid entry.
+
+        Returns:
+            (mel, n_samples) as returned by compute_mel().
+        """
+        cached = self.load(recording, key)
+        if cached is not None:
+            print(f"⏭️ Mel frontend cached: {self.path_for(recording)}")
+            return cached
+
+        mel, n_samples = compute_mel(load_audio(), self.params)
+        self.store(recording, key, mel, n_samples)
+        print(f"💾 Cached mel frontend: {self.path_for(recording)} {mel.shape}")
+        return mel, n_samples
@@ -3,6 +3,8 @@ import numpy as np
 import json
 from collections import defaultdict
 
+from src.inference import load_embedding_rows
+
 # Directory with embeddings
 EMBEDDING_DIR = "data/embeddings"
 
@@ -20,7 +22,10 @@ def compute_profiles(embedding_dir, metadata_file):
         for line in f.readlines()[1:]:  # Skip header
             fname, region = line.strip().split(",")
             fpath = os.path.join(embedding_dir, fname)
-            embedding = np.load(fpath)
+            # Reads .npy and .rhde files alike; pickled or malformed files are skipped
+            embedding = load_embedding_rows(fpath)
+            if embedding is None:
+                continue
             region_data[region].append(embedding)
 
     # Compute mean and covariance for each region
@@ -0,0 +1,96 @@
+# Memory-bounded batch inference helpers
+# Embeddings are streamed from disk into one preallocated float32 buffer and
+# scored chunk by chunk, so peak memory does not grow with the number of files.
+
+import numpy as np
+import pandas as pd
+
+from src.embedding import generate_random_patient_id
+from src.embedding_format import EXTENSION, read_embedding
+
+EMBEDDING_DIM = 512
+DEFAULT_CHUNK_SIZE = 256
+FEATURE_COLUMNS = [f"openl3_feature_{i}" for i in range(EMBEDDING_DIM)]
+
+
+def load_embedding_rows(path, dim=EMBEDDING_DIM):
+    """
+    Load one embedding file as a (n_rows, dim) array, or return None if unusable.
+
+    .rhde files are decoded (and checksum-verified); numeric .npy files are
+    memory-mapped. Pickled .npy files are never loaded.
+    """
+    try:
+        if path.endswith(EXTENSION):
+            emb, _ = read_embedding(path)
+        else:
+            emb = np.load(path, mmap_mode="r", allow_pickle=False)
+        emb = np.asarray(emb).squeeze()
+    except Exception as e:
+        print(f"❌ ERROR loading {path}: {e}")
+        return None
+
+    if emb.ndim == 0:
+        print(f"⚠️ Skipping {path}: scalar value detected (shape={emb.shape})")
+        return None
+
+    if emb.shape[-1] != dim:
+        print(f"⚠️ Skipping {path}: invalid shape {emb.shape} (expected last dim={dim})")
+        return None
+
+    return emb.reshape(-1, dim)
+
+
+def iter_embedding_chunks(paths, chunk_size=DEFAULT_CHUNK_SIZE, dim=EMBEDDING_DIM, on_unreadable=None):
+    """
+    Stream embedding rows from `paths` in chunks of at most `chunk_size` rows.
+
+    Files that cannot be loaded are skipped; `on_unreadable(path)`, if given,
+    is called for each of them.
+
+    Yields:
+        (block, row_files, completed_files):
+            block: float32 view of shape (n, dim) into a buffer that is reused
+                for the next chunk, so it must be consumed before iterating on.
+            row_files: source path of every row in block.
+            completed_files: paths whose last row is in this chunk.
+    """
+    buffer = np.empty((chunk_size, dim), dtype=np.float32)
+    row_files = []
+    completed_files = []
+    filled = 0
+
+    for path in paths:
+        rows = load_embedding_rows(path, dim)
+        if rows is None:
+            if on_unreadable is not None:
+                on_unreadable(path)
+            continue
+
+        start = 0
+        while start < len(rows):
+            take = min(chunk_size - filled, len(rows) - start)
+            buffer[filled:filled + take] = rows[start:start + take]
+            row_files.extend([path] * take)
+            filled += take
+            start += take
+
+            if start == len(rows):
+                completed_files.append(path)
+
+            if filled == chunk_size:
+                yield buffer[:filled], row_files, completed_files
+                row_files, completed_files, filled = [], [], 0
+
+    if filled:
+        yield buffer[:filled], row_files, completed_files
+
+
+def build_inference_frame(block):
+    """
+    Wrap a float32 block in the DataFrame layout the scoring endpoint expects:
+    a 'Patient ID' column followed by openl3_feature_0 … openl3_feature_511.
+    """
+    df = pd.DataFrame(block, columns=FEATURE_COLUMNS[:block.shape[1]], copy=False)
+    df.insert(0, "Patient ID", [generate_random_patient_id() for _ in range(len(block))])
+    return df
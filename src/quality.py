@@ -0,0 +1,118 @@
+# Signal-quality gate for heart sound recordings
+# Cheap, vectorized checks on the decoded waveform (duration, loudness,
+# clipping and how much energy sits in the heart-sound band) that run before
+# noisereduce and OpenL3, so unusable recordings never reach the expensive path.
+
+import os
+import json
+
+import numpy as np
+
+QUALITY_CONFIG_PATH = "config/quality_thresholds.json"
+
+DEFAULT_QUALITY_THRESHOLDS = {
+    "min_duration_s": 4.0,          # OpenL3 needs several 1 s windows to pool over
+    "min_rms": 1e-3,                # about -60 dBFS; quieter is treated as silence
+    "clip_level": 0.999,            # |sample| at or above this counts as clipped
+    "max_clip_ratio": 0.01,         # fraction of clipped samples allowed
+    "band_hz": [20, 600],           # where S1/S2 heart sounds and murmurs live
+    "min_band_energy_ratio": 0.1,   # share of spectral energy required in band_hz
+}
+
+# Spectral energy is averaged over frames of this many samples
+_FRAME_SIZE = 4096
+
+
+def load_quality_thresholds(path=QUALITY_CONFIG_PATH):
+    """
+    Default thresholds, overridden by any keys present in the JSON file at `path`.
+    """
+    thresholds = dict(DEFAULT_QUALITY_THRESHOLDS)
+    if path and os.path.exists(path):
+        with open(path, "r") as f:
+            thresholds.update(json.load(f))
+    return thresholds
+
+
+def band_energy_ratio(y, sr, band_hz):
+    """
+    Fraction of spectral energy inside band_hz, from framed FFTs of the signal.
+    """
+    frame = min(_FRAME_SIZE, len(y))
+    n_frames = len(y) // frame
+    frames = y[: n_frames * frame].reshape(n_frames, frame)
+    power = (np.abs(np.fft.rfft(frames, axis=1)) ** 2).sum(axis=0)
+    freqs = np.fft.rfftfreq(frame, d=1.0 / sr)
+
+    total = power.sum()
+    if total <= 0:
+        return 0.0
+    in_band = (freqs >= band_hz[0]) & (freqs <= band_hz[1])
+    return float(power[in_band].sum() / total)
+
+
+def assess_quality(y, sr, thresholds=None):
+    """
+    Compute quality metrics for a decoded recording and check them against thresholds.
+
+    Args:
+        y (np.ndarray): Audio samples in [-1, 1], mono or (n_samples, channels).
+        sr (int): Sample rate of y.
+        thresholds (dict, optional): See DEFAULT_QUALITY_THRESHOLDS.
+
+    Returns:
+        (metrics, reasons): dict of measured values and a list of failure
+        reasons; an empty list means the recording passed.
+    """
+    thresholds = thresholds or DEFAULT_QUALITY_THRESHOLDS
+    y = np.asarray(y, dtype=np.float32)
+    if y.ndim > 1:
+        y = y.mean(axis=1)
+
+    duration = len(y) / sr if sr else 0.0
+    if len(y) == 0:
+        return {"duration_s": 0.0}, ["empty recording"]
+    if not np.isfinite(y).all():
+        # NaN metrics would pass every threshold comparison
+        return {"duration_s": duration}, ["non-finite samples (NaN or inf)"]
+
+    # Clipping is about the raw sample values; loudness and spectral balance are
+    # measured around the mean so a DC offset counts as neither signal nor band energy
+    clip_ratio = float(np.mean(np.abs(y) >= thresholds["clip_level"]))
+    y = y - y.mean(dtype=np.float64)
+
+    metrics = {
+        "duration_s": duration,
+        "rms": float(np.sqrt(np.mean(np.square(y, dtype=np.float64)))),
+        "clip_ratio": clip_ratio,
+        "band_energy_ratio": band_energy_ratio(y, sr, thresholds["band_hz"]),
+    }
+
+    reasons = []
+    if duration < thresholds["min_duration_s"]:
+        reasons.append(f"too short ({duration:.2f}s < {thresholds['min_duration_s']}s)")
+    if metrics["rms"] < thresholds["min_rms"]:
+        reasons.append(f"near-silent (RMS {metrics['rms']:.2e} < {thresholds['min_rms']})")
+    if metrics["clip_ratio"] > thresholds["max_clip_ratio"]:
+        reasons.append(f"clipped ({metrics['clip_ratio']:.1%} of samples)")
+    if metrics["band_energy_ratio"] < thresholds["min_band_energy_ratio"]:
+        low, high = thresholds["band_hz"]
+        reasons.append(
+            f"little heart-sound energy ({metrics['band_energy_ratio']:.1%} in {low}-{high} Hz)"
+        )
+
+    return metrics, reasons
+
+
+def assess_file(path, thresholds=None):
+    """
+    assess_quality() on an audio file, decoded at its native sample rate.
+    Unreadable files are reported as a failure rather than raised.
+    """
+    import soundfile as sf
+
+    try:
+        y, sr = sf.read(path, dtype="float32", always_2d=False)
+    except Exception as e:
+        return {}, [f"unreadable ({e})"]
+    return assess_quality(y, sr, thresholds)
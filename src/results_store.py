@@ -0,0 +1,167 @@
+# Columnar store for RED-RHD prediction results
+# Predictions are appended as Parquet files partitioned by run ID, so every
+# pipeline run keeps its own history instead of overwriting a single CSV.
+
+import os
+import uuid
+from datetime import datetime, timezone
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from src.run_manifest import recording_id, params_key
+
+LOCAL_RESULTS_DIR = "data/results"
+BLOB_RESULTS_PREFIX = "predictions/store"
+
+RESULTS_SCHEMA = pa.schema([
+    ("recording", pa.string()),
+    ("file", pa.string()),
+    ("prediction", pa.string()),
+    # Canonical JSON of the scoring parameters (model / routing) behind the prediction
+    ("score_params", pa.string()),
+    ("created_at", pa.timestamp("us", tz="UTC")),
+])
+
+
+def new_run_id():
+    """
+    Generate a run ID, e.g. "20250709T141502Z-3f9a1c".
+
+    IDs from the same second do not sort by start time; order runs by their
+    created_at instead (see latest_run_id()).
+    """
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    return f"{stamp}-{uuid.uuid4().hex[:6]}"
+
+
+def append_predictions(results_df, run_id, root=LOCAL_RESULTS_DIR, score_params=None):
+    """
+    Append a batch of predictions to the results store.
+
+    Each call writes one new Parquet file under run_id=<run_id>/, so appends
+    never rewrite earlier data.
+
+    Parameters:
+        results_df (pd.DataFrame): Must contain "file" and "prediction" columns.
+        run_id (str): Pipeline run identifier (see new_run_id()).
+        root (str): Local root directory of the store.
+        score_params (dict, optional): How the predictions were made; stored so
+            they are only reused for runs with the same parameters.
+
+    Returns:
+        str: Path to the written Parquet file.
+    """
+    table = pa.table({
+        "recording": [recording_id(f) for f in results_df["file"]],
+        "file": [os.path.basename(f) for f in results_df["file"]],
+        # Predictions are stored as strings so labels and scores share one column
+        "prediction": [str(p) for p in results_df["prediction"]],
+        "score_params": [params_key(score_params)] * len(results_df),
+        "created_at": [datetime.now(timezone.utc)] * len(results_df),
+    }, schema=RESULTS_SCHEMA)
+
+    partition_dir = os.path.join(root, f"run_id={run_id}")
+    os.makedirs(partition_dir, exist_ok=True)
+    part_path = os.path.join(partition_dir, f"part-{uuid.uuid4().hex}.parquet")
+    pq.write_table(table, part_path)
+    return part_path
+
+
+def list_run_files(run_id, root=LOCAL_RESULTS_DIR):
+    """
+    Return the Parquet files written for one run.
+    """
+    partition_dir = os.path.join(root, f"run_id={run_id}")
+    if not os.path.isdir(partition_dir):
+        return []
+    return sorted(
+        os.path.join(partition_dir, name)
+        for name in os.listdir(partition_dir)
+        if name.endswith(".parquet")
+    )
+
+
+def list_part_files(root=LOCAL_RESULTS_DIR):
+    """
+    Return the Parquet files of every run in the store.
+    """
+    if not os.path.isdir(root):
+        return []
+    return [
+        part_path
+        for name in sorted(os.listdir(root))
+        if name.startswith("run_id=")
+        for part_path in list_run_files(name[len("run_id="):], root)
+    ]
+
+
+def latest_run_id(root=LOCAL_RESULTS_DIR):
+    """
+    Return the most recently started run ID in the store, or None if it is empty.
+
+    A run starts at the created_at of its earliest prediction.
+    """
+    df = load_predictions(root, columns=["run_id", "created_at"])
+    if df.empty:
+        return None
+    started = df.groupby("run_id")["created_at"].min()
+    return started.idxmax()
+
+
+def load_predictions(root=LOCAL_RESULTS_DIR, recordings=None, columns=None):
+    """
+    Read predictions from the store as a DataFrame.
+
+    Parameters:
+        root (str): Local root directory of the store.
+        recordings (list, optional): Only return rows for these recording IDs.
+        columns (list, optional): Only read these columns.
+
+    Returns:
+        pd.DataFrame: Columns recording, file, prediction, score_params, created_at, run_id.
+    """
+    schema = RESULTS_SCHEMA.append(pa.field("run_id", pa.string()))
+    if not os.path.isdir(root):
+        return pd.DataFrame(columns=columns or schema.names)
+
+    dataset = ds.dataset(root, format="parquet", partitioning="hive", schema=schema)
+    row_filter = None
+    if recordings is not None:
+        row_filter = ds.field("recording").isin(list(recordings))
+    return dataset.to_table(columns=columns, filter=row_filter).to_pandas()
+
+
+def latest_predictions(recordings, root=LOCAL_RESULTS_DIR, score_params=None):
+    """
+    Most recent stored prediction for each of `recordings` (every recording if None).
+
+    Parameters:
+        score_params (dict, optional): Only consider predictions made with these
+            scoring parameters (see append_predictions()).
+
+    Returns:
+        dict: recording ID -> prediction (as stored, i.e. a string).
+    """
+    if recordings is not None:
+        recordings = list(recordings)
+        if not recordings:
+            return {}
+    df = load_predictions(root, recordings)
+    if score_params is not None:
+        df = df[df["score_params"] == params_key(score_params)]
+    if df.empty:
+        return {}
+    # Run IDs are not ordered in time; created_at is
+    df = df.sort_values("created_at", kind="stable").drop_duplicates("recording", keep="last")
+    return dict(zip(df["recording"], df["prediction"]))
+
+
+def blob_path_for(part_path, root=LOCAL_RESULTS_DIR):
+    """
+    Map a local Parquet part file to its blob name under predictions/store/.
+    """
+    rel = os.path.relpath(part_path, root).replace(os.sep, "/")
+    return f"{BLOB_RESULTS_PREFIX}/{rel}"
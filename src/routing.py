@@ -0,0 +1,50 @@
+# Region-routed batch scoring
+# Each embedding is assigned to its nearest region profile, rows are grouped by
+# region, and every region model scores its whole group with one predict call.
+
+import numpy as np
+
+from src.inference import build_inference_frame
+from src.selector import prepare_region_profiles, select_region_profiles
+
+
+class RegionRouter:
+    """
+    Scores embedding batches with per-region models.
+
+    Parameters:
+        region_profiles (dict): {region: {"mean": [...], "cov": [[...]]}}.
+        load_model (callable): region name -> fitted model with .predict(DataFrame).
+            Called at most once per region; models are kept for later batches.
+    """
+
+    def __init__(self, region_profiles, load_model):
+        self.profiles = prepare_region_profiles(region_profiles)
+        self.load_model = load_model
+        self.models = {}
+
+    def model_for(self, region):
+        if region not in self.models:
+            print(f"🟣 Loading model for region: {region}")
+            self.models[region] = self.load_model(region)
+        return self.models[region]
+
+    def score(self, X):
+        """
+        Score `X` (n, 512) and return (predictions, regions) in the original row order.
+        """
+        regions, _ = select_region_profiles(X, self.profiles)
+        predictions = np.empty(len(X), dtype=object)
+
+        # Stable sort keeps each group in input order; split at region boundaries
+        order = np.argsort(regions, kind="stable")
+        group_regions, starts = np.unique(regions[order], return_index=True)
+
+        for region, rows in zip(group_regions, np.split(order, starts[1:])):
+            model = self.model_for(region)
+            print(f"📈 Scoring {len(rows)} embeddings with the {region} model")
+            preds = model.predict(build_inference_frame(X[rows]))
+            for row, pred in zip(rows, preds):
+                predictions[row] = pred
+
+        return predictions, regions
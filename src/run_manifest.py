@@ -0,0 +1,175 @@
+# Per-recording run manifest for the RED-RHD pipeline
+# A small SQLite database remembers which stages every recording has finished,
+# together with the content hash and parameters they were run with, so a rerun
+# resumes from the first incomplete stage instead of starting again at STEP 0.
+
+import os
+import json
+import sqlite3
+import hashlib
+from datetime import datetime, timezone
+
+LOCAL_MANIFEST_PATH = "data/run_manifest.sqlite"
+
+# Stages in pipeline order
+STAGES = ("downloaded", "denoised", "embedded", "uploaded", "scored")
+
+# Recordings turned away by the quality gate; not part of the stage order
+REJECTED = "rejected"
+
+# Embedding files that could not be loaded for scoring; retried once the file changes
+UNREADABLE = "unreadable"
+
+# Markers that can be recorded alongside the stages
+MARKERS = (REJECTED, UNREADABLE)
+
+
+def recording_id(filename):
+    """
+    Map an audio or embedding filename to its recording ID.
+
+    "recordings/abc_raw.wav" and "abc_raw_embedding.npy" both map to "abc_raw".
+    """
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    for suffix in ("_embedding", "_denoised"):
+        if stem.endswith(suffix):
+            stem = stem[: -len(suffix)]
+    return stem
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """
+    SHA-256 of a local file, read in chunks.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def params_key(params):
+    """
+    Canonical JSON form of a params dict, used to compare runs' parameters.
+    """
+    return json.dumps(params or {}, sort_keys=True, default=str)
+
+
+class RunManifest:
+    """
+    State DB with one row per (recording, stage).
+
+    A stage counts as complete when its row exists, was recorded with the same
+    content hash and parameters, and its artifact (if any) is still on disk.
+    """
+
+    def __init__(self, path=LOCAL_MANIFEST_PATH):
+        self.path = path
+        parent = os.path.dirname(path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS stages (
+                recording    TEXT NOT NULL,
+                stage        TEXT NOT NULL,
+                content_hash TEXT,
+                params       TEXT NOT NULL,
+                artifact     TEXT,
+                updated_at   TEXT NOT NULL,
+                PRIMARY KEY (recording, stage)
+            )
+            """
+        )
+        self.conn.commit()
+
+    def record(self, recording, stage, content_hash=None, params=None, artifact=None):
+        """
+        Mark `stage` as finished for `recording`. Rows for later stages are
+        dropped, since they were computed from the previous output of this stage.
+        """
+        if stage not in STAGES and stage not in MARKERS:
+            raise ValueError(f"Unknown stage '{stage}', expected one of {STAGES + MARKERS}")
+
+        later = STAGES[STAGES.index(stage) + 1:] if stage in STAGES else ()
+        with self.conn:
+            self.conn.execute(
+                """
+                INSERT OR REPLACE INTO stages
+                    (recording, stage, content_hash, params, artifact, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    recording,
+                    stage,
+                    content_hash,
+                    params_key(params),
+                    artifact,
+                    datetime.now(timezone.utc).isoformat(),
+                ),
+            )
+            if later:
+                placeholders = ",".join("?" for _ in later)
+                self.conn.execute(
+                    f"DELETE FROM stages WHERE recording = ? AND stage IN ({placeholders})",
+                    (recording, *later),
+                )
+
+    def get(self, recording, stage):
+        """
+        Return the row for (recording, stage) as a dict, or None.
+        """
+        row = self.conn.execute(
+            "SELECT * FROM stages WHERE recording = ? AND stage = ?",
+            (recording, stage),
+        ).fetchone()
+        if row is None:
+            return None
+        row = dict(row)
+        row["params"] = json.loads(row["params"])
+        return row
+
+    def is_complete(self, recording, stage, content_hash=None, params=None):
+        """
+        True if `stage` already ran for `recording` with this hash and these params.
+        """
+        row = self.get(recording, stage)
+        if row is None:
+            return False
+        if content_hash is not None and row["content_hash"] != content_hash:
+            return False
+        if params is not None and params_key(row["params"]) != params_key(params):
+            return False
+        if row["artifact"] and not os.path.exists(row["artifact"]):
+            return False
+        return True
+
+    def forget(self, recording, stage):
+        """
+        Drop the row for (recording, stage), if any.
+        """
+        with self.conn:
+            self.conn.execute(
+                "DELETE FROM stages WHERE recording = ? AND stage = ?", (recording, stage)
+            )
+
+    def recordings_at(self, stage):
+        """
+        Set of recordings that have finished `stage`.
+        """
+        rows = self.conn.execute(
+            "SELECT recording FROM stages WHERE stage = ?", (stage,)
+        ).fetchall()
+        return {row["recording"] for row in rows}
+
+    def reset(self):
+        """
+        Forget all recorded progress.
+        """
+        with self.conn:
+            self.conn.execute("DELETE FROM stages")
+
+    def close(self):
+        self.conn.close()
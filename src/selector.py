@@ -18,3 +18,44 @@ def select_region_profile(embedding, region_profiles):
             best_distance = dist
             best_region = region
     return best_region
+
+
+def prepare_region_profiles(region_profiles):
+    """
+    Stack region means and inverse covariances once, for select_region_profiles().
+
+    Returns:
+        (names, means, inv_covs): list of region names, (r, d) means, (r, d, d) inverses.
+    """
+    names = list(region_profiles)
+    means = np.array([region_profiles[r]['mean'] for r in names], dtype=np.float64)
+    # pinv rather than inv: covariances of 512-d embeddings are often singular
+    inv_covs = np.array([np.linalg.pinv(np.array(region_profiles[r]['cov'], dtype=np.float64)) for r in names])
+    return names, means, inv_covs
+
+
+def select_region_profiles(X, region_profiles):
+    """
+    Vectorized select_region_profile() for a batch of embeddings.
+
+    Args:
+        X (np.ndarray): Embeddings, shape (n, d).
+        region_profiles (dict | tuple): Profiles as loaded from JSON, or the
+            output of prepare_region_profiles().
+
+    Returns:
+        (regions, distances): (n,) array of region names and (n,) Mahalanobis distances.
+    """
+    if isinstance(region_profiles, dict):
+        region_profiles = prepare_region_profiles(region_profiles)
+    names, means, inv_covs = region_profiles
+
+    X = np.atleast_2d(np.asarray(X, dtype=np.float64))
+    sq_dists = np.empty((len(X), len(names)))
+    for j in range(len(names)):
+        diff = X - means[j]
+        sq_dists[:, j] = np.einsum('ij,jk,ik->i', diff, inv_covs[j], diff)
+
+    best = np.argmin(sq_dists, axis=1)
+    distances = np.sqrt(np.maximum(sq_dists[np.arange(len(X)), best], 0.0))
+    return np.asarray(names, dtype=object)[best], distances
@@ -0,0 +1,281 @@
+# Embedding similarity index for RED-RHD recordings
+# Cosine k-NN over pooled 512-d OpenL3 embeddings. Small collections are
+# searched exactly with one BLAS matrix product per query block; large ones
+# switch to an inverted-file index (k-means partitions) that keeps the vectors
+# as float16 and scans only the partitions nearest to each query. float16
+# round-off is far below the duplicate threshold's margin.
+
+import os
+
+import numpy as np
+
+LOCAL_INDEX_PATH = "data/index/embedding_index.npz"
+BLOB_INDEX_PATH = "index/embedding_index.npz"
+
+# Above this many vectors the index is built as an approximate IVF index
+EXACT_MAX_SIZE = 20000
+
+# Cosine similarity at or above which two recordings count as the same audio
+DUPLICATE_THRESHOLD = 0.9995
+
+# Exact search computes (query block x index) similarities; bound that matrix
+_MAX_SCORE_ELEMENTS = 1 << 24
+
+
+def _normalize(X):
+    X = np.asarray(X, dtype=np.float32)
+    if X.ndim == 1:
+        X = X.reshape(1, -1)
+    norms = np.linalg.norm(X, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return X / norms
+
+
+def _train_centroids(X, n_lists, n_iter=10, seed=0):
+    """
+    Spherical k-means on (a sample of) the normalized vectors.
+    """
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(X), n_lists * 64)
+    sample = X[rng.choice(len(X), sample_size, replace=False)]
+    centroids = sample[rng.choice(sample_size, n_lists, replace=False)].copy()
+
+    for _ in range(n_iter):
+        assign = np.argmax(sample @ centroids.T, axis=1)
+        for lst in range(n_lists):
+            members = sample[assign == lst]
+            if len(members):
+                centroids[lst] = members.sum(axis=0)
+        centroids = _normalize(centroids)
+
+    return centroids
+
+
+def _merge_topk(best_sims, best_idx, sims, idx, k):
+    """
+    Merge candidate (sims, idx) columns into running top-k arrays, row-wise.
+    """
+    all_sims = np.concatenate([best_sims, sims], axis=1)
+    all_idx = np.concatenate([best_idx, idx], axis=1)
+    if all_sims.shape[1] > k:
+        top = np.argpartition(-all_sims, k - 1, axis=1)[:, :k]
+        all_sims = np.take_along_axis(all_sims, top, axis=1)
+        all_idx = np.take_along_axis(all_idx, top, axis=1)
+    return all_sims, all_idx
+
+
+class EmbeddingIndex:
+    """
+    Cosine-similarity index mapping embedding rows to recording IDs.
+
+    Parameters:
+        exact_max_size (int): Largest collection searched exactly; bigger ones use IVF.
+        n_probe (int): IVF partitions scanned per query.
+    """
+
+    def __init__(self, exact_max_size=EXACT_MAX_SIZE, n_probe=8):
+        self.exact_max_size = exact_max_size
+        self.n_probe = n_probe
+        # IVF mode
+        self.centroids = None
+        # Per-row arrays: "ids", "vectors" (float32 in exact mode, float16 in
+        # IVF mode) and in IVF mode "lists", each row's partition. They keep
+        # spare capacity so add() does not copy the whole index.
+        self._rows = {}
+        self._size = 0
+
+    def _view(self, name):
+        buffer = self._rows.get(name)
+        return None if buffer is None else buffer[:self._size]
+
+    @property
+    def ids(self):
+        ids = self._view("ids")
+        return np.array([], dtype=object) if ids is None else ids
+
+    @property
+    def vectors(self):
+        vectors = self._view("vectors")
+        return np.empty((0, 0), dtype=np.float32) if vectors is None else vectors
+
+    @property
+    def lists(self):
+        return self._view("lists")
+
+    @property
+    def is_exact(self):
+        return self.centroids is None
+
+    def __len__(self):
+        return self._size
+
+    def _set_rows(self, **rows):
+        """
+        Replace every per-row array (None values are left out).
+        """
+        self._rows = {name: np.asarray(array) for name, array in rows.items() if array is not None}
+        self._rows["ids"] = np.asarray(rows["ids"], dtype=object)
+        self._size = len(self._rows["ids"])
+
+    def _append_rows(self, **rows):
+        """
+        Append to the per-row arrays, doubling a buffer's capacity when it is full.
+        """
+        needed = self._size + len(rows["ids"])
+        for name, new in rows.items():
+            new = np.asarray(new, dtype=object if name == "ids" else None)
+            buffer = self._rows.get(name)
+            if buffer is None or len(buffer) < needed:
+                capacity = max(needed, 2 * (0 if buffer is None else len(buffer)), 1024)
+                grown = np.empty((capacity,) + new.shape[1:], dtype=new.dtype)
+                if buffer is not None:
+                    grown[:self._size] = buffer[:self._size]
+                buffer = self._rows[name] = grown
+            buffer[self._size:needed] = new
+        self._size = needed
+
+    def build(self, ids, X):
+        """
+        (Re)build the index over `X` (n, d) with one ID per row.
+        """
+        X = _normalize(X)
+
+        if len(X) <= self.exact_max_size:
+            self.centroids = None
+            self._set_rows(ids=ids, vectors=X)
+            return self
+
+        n_lists = max(int(np.sqrt(len(X))), 1)
+        self.centroids = _train_centroids(X, n_lists)
+        lists = np.argmax(X @ self.centroids.T, axis=1).astype(np.int32)
+        self._set_rows(ids=ids, vectors=X.astype(np.float16), lists=lists)
+        return self
+
+    def add(self, ids, X):
+        """
+        Append rows. An exact index that grows past exact_max_size is rebuilt as IVF.
+        """
+        X = _normalize(X)
+
+        if self.is_exact:
+            if len(self) + len(X) > self.exact_max_size:
+                return self.build(np.concatenate([self.ids, np.asarray(ids, dtype=object)]),
+                                  np.vstack([self.vectors, X]) if len(self) else X)
+            self._append_rows(ids=ids, vectors=X)
+            return self
+
+        lists = np.argmax(X @ self.centroids.T, axis=1).astype(np.int32)
+        self._append_rows(ids=ids, vectors=X.astype(np.float16), lists=lists)
+        return self
+
+    def vectors_for(self, recording):
+        """
+        Stored (normalized; float16 precision in IVF mode) vectors of one recording.
+        """
+        rows = np.flatnonzero(self.ids == recording)
+        return self.vectors[rows].astype(np.float32)
+
+    def search(self, Q, k=5):
+        """
+        Batch k-nearest-neighbour query.
+
+        Parameters:
+            Q (np.ndarray): Query embeddings, shape (m, d) or (d,).
+            k (int): Neighbours per query.
+
+        Returns:
+            (sims, ids): Arrays of shape (m, k) sorted by decreasing cosine
+            similarity. Missing neighbours have similarity -inf and ID "".
+        """
+        Q = _normalize(Q)
+        k = max(int(k), 1)
+        best_sims = np.full((len(Q), 0), -np.inf, dtype=np.float32)
+        best_idx = np.zeros((len(Q), 0), dtype=np.int64)
+
+        if len(self) == 0:
+            pass
+        elif self.is_exact:
+            block = max(_MAX_SCORE_ELEMENTS // len(self), 1)
+            sims_blocks, idx_blocks = [], []
+            for start in range(0, len(Q), block):
+                sims = Q[start:start + block] @ self.vectors.T
+                idx = np.broadcast_to(np.arange(len(self)), sims.shape)
+                s, i = _merge_topk(best_sims[start:start + block], best_idx[start:start + block], sims, idx, k)
+                sims_blocks.append(s)
+                idx_blocks.append(i)
+            best_sims, best_idx = np.vstack(sims_blocks), np.vstack(idx_blocks)
+        else:
+            n_probe = min(self.n_probe, len(self.centroids))
+            probes = np.argpartition(-(Q @ self.centroids.T), n_probe - 1, axis=1)[:, :n_probe]
+            best_sims = np.full((len(Q), k), -np.inf, dtype=np.float32)
+            best_idx = np.zeros((len(Q), k), dtype=np.int64)
+            # Group queries by partition so each partition is scanned with one matmul
+            for lst in np.unique(probes):
+                queries = np.flatnonzero((probes == lst).any(axis=1))
+                members = np.flatnonzero(self.lists == lst)
+                if len(members) == 0:
+                    continue
+                sims = Q[queries] @ self.vectors[members].T.astype(np.float32)
+                np.clip(sims, -1.0, 1.0, out=sims)  # float16 round-off
+                idx = np.broadcast_to(members, sims.shape)
+                best_sims[queries], best_idx[queries] = _merge_topk(
+                    best_sims[queries], best_idx[queries], sims, idx, k
+                )
+
+        # Pad to k columns and sort by similarity
+        if best_sims.shape[1] < k:
+            pad = k - best_sims.shape[1]
+            best_sims = np.pad(best_sims, ((0, 0), (0, pad)), constant_values=-np.inf)
+            best_idx = np.pad(best_idx, ((0, 0), (0, pad)), constant_values=-1)
+        order = np.argsort(-best_sims, axis=1, kind="stable")
+        best_sims = np.take_along_axis(best_sims, order, axis=1)
+        best_idx = np.take_along_axis(best_idx, order, axis=1)
+
+        ids = np.where(np.isfinite(best_sims), self.ids[np.clip(best_idx, 0, None)] if len(self) else "", "")
+        return best_sims, ids
+
+    def find_duplicates(self, Q, threshold=DUPLICATE_THRESHOLD):
+        """
+        Nearest indexed recording for each query, or None if it is below `threshold`.
+
+        Returns:
+            list of (recording_id or None, similarity) tuples, one per query.
+        """
+        sims, ids = self.search(Q, k=1)
+        return [
+            (str(rec) if sim >= threshold else None, float(sim))
+            for rec, sim in zip(ids[:, 0], sims[:, 0])
+        ]
+
+    def save(self, path=LOCAL_INDEX_PATH):
+        parent = os.path.dirname(path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        arrays = {"ids": self.ids.astype(str), "vectors": self.vectors,
+                  "exact_max_size": np.int64(self.exact_max_size)}
+        if not self.is_exact:
+            arrays.update(centroids=self.centroids, lists=self.lists)
+        # Write then rename, so a crash mid-save leaves the previous index intact
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=LOCAL_INDEX_PATH):
+        """
+        Load an index written by save(). `path` may also be a file-like object.
+        """
+        with np.load(path, allow_pickle=False) as data:
+            index = cls(exact_max_size=int(data["exact_max_size"]))
+            rows = {name: data[name] for name in ("ids", "vectors", "lists") if name in data}
+            if "centroids" in data:
+                index.centroids = data["centroids"]
+            index._set_rows(**rows)
+        return index
+
+    @classmethod
+    def load_or_create(cls, path=LOCAL_INDEX_PATH):
+        if os.path.exists(path):
+            return cls.load(path)
+        return cls()
@@ -0,0 +1,224 @@
+# Checks for the pipeline's resumable state and storage helpers
+# Everything runs on local temp files; Azure is replaced by an in-memory fake
+# aio container client, so no network access or credentials are needed.
+#
+# Usage (from the repository root):
+#     python -m pytest tests
+
+import os
+import sys
+import hashlib
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.embedding_format import write_embedding, read_embedding
+from src.inference import iter_embedding_chunks
+from src.run_manifest import RunManifest, UNREADABLE
+from src.similarity import EmbeddingIndex
+
+DIM = 512
+
+
+# ---------------------------
+# AsyncBlobUploader
+# ---------------------------
+class FakeContainerClient:
+    """
+    Just enough of azure.storage.blob.aio.ContainerClient for AsyncBlobUploader.
+    """
+
+    def __init__(self, blobs=None, failing=()):
+        self.blobs = dict(blobs or {})
+        self.failing = set(failing)
+        self.uploaded = []
+        self.closed = False
+
+    async def list_blobs(self, name_starts_with=None):
+        for name, data in list(self.blobs.items()):
+            if name_starts_with is None or name.startswith(name_starts_with):
+                md5 = bytearray(hashlib.md5(data).digest())
+                yield SimpleNamespace(name=name, content_settings=SimpleNamespace(content_md5=md5))
+
+    async def upload_blob(self, name, data, overwrite=False, content_settings=None):
+        if name in self.failing:
+            raise RuntimeError(f"upload of {name} refused")
+        self.blobs[name] = data
+        self.uploaded.append(name)
+
+    async def close(self):
+        self.closed = True
+
+
+def test_uploader_skips_unchanged_blobs_and_reports_failures(tmp_path):
+    pytest.importorskip("azure.storage.blob.aio")
+    from src.async_upload import AsyncBlobUploader
+
+    files = {}
+    for name, data in [("same", b"unchanged"), ("new", b"fresh"), ("bad", b"refused"), ("big", b"x" * 4096)]:
+        path = tmp_path / f"{name}.bin"
+        path.write_bytes(data)
+        files[name] = str(path)
+
+    fake = FakeContainerClient(blobs={"embeddings/same.bin": b"unchanged"}, failing={"embeddings/bad.bin"})
+    with AsyncBlobUploader(client_factory=lambda: fake, small_object_bytes=1024) as uploader:
+        futures = {name: uploader.submit(path, f"embeddings/{name}.bin") for name, path in files.items()}
+
+    assert futures["same"].result() == "skipped"
+    assert futures["new"].result() == "uploaded"
+    assert futures["big"].result() == "uploaded"
+    with pytest.raises(RuntimeError):
+        futures["bad"].result()
+
+    assert sorted(fake.uploaded) == ["embeddings/big.bin", "embeddings/new.bin"]
+    assert uploader.stats == {"uploaded": 2, "skipped": 1, "failed": 1}
+    assert fake.closed
+
+
+# ---------------------------
+# .rhde embedding files
+# ---------------------------
+@pytest.mark.parametrize("dtype, tolerance", [("float32", 0.0), ("float16", 1e-3), ("int8", 1 / 127)])
+def test_rhde_round_trip(tmp_path, dtype, tolerance):
+    X = np.random.default_rng(0).normal(size=(3, DIM)).astype(np.float32)
+    path = str(tmp_path / "rec_embedding.rhde")
+
+    write_embedding(path, X, dtype, params={"hop_size": 0.1, "pooling": "none"})
+    Y, header = read_embedding(path)
+
+    assert header["dtype"] == dtype
+    assert header["shape"] == [3, DIM]
+    assert header["params"] == {"hop_size": 0.1, "pooling": "none"}
+    np.testing.assert_allclose(Y, X, rtol=0, atol=tolerance * np.abs(X).max())
+
+
+def test_rhde_rejects_corrupt_payload(tmp_path):
+    path = tmp_path / "rec_embedding.rhde"
+    write_embedding(str(path), np.ones(DIM, dtype=np.float32))
+    data = bytearray(path.read_bytes())
+    data[-1] ^= 0xFF
+    path.write_bytes(bytes(data))
+
+    with pytest.raises(ValueError, match="checksum"):
+        read_embedding(str(path))
+
+
+# ---------------------------
+# Streaming embedding chunks
+# ---------------------------
+def test_iter_embedding_chunks_tracks_row_files_and_completed_files(tmp_path):
+    def rows(file_number, n):
+        X = np.full((n, DIM), file_number, dtype=np.float32)
+        X[:, 1] = np.arange(n)
+        return X
+
+    a, b, c = rows(1, 3), rows(2, 5), rows(3, 2)
+    path_a = str(tmp_path / "a_embedding.npy")
+    path_b = str(tmp_path / "b_embedding.rhde")
+    path_bad = str(tmp_path / "bad.npy")
+    path_c = str(tmp_path / "c_embedding.npy")
+    np.save(path_a, a)
+    write_embedding(path_b, b, "float32")
+    with open(path_bad, "wb") as f:
+        # A pickled object array, like the stray files found in the container
+        np.save(f, np.array([{"not": "an embedding"}], dtype=object), allow_pickle=True)
+    np.save(path_c, c)
+
+    unreadable = []
+    chunks = [
+        (block.copy(), list(row_files), list(completed))  # the block buffer is reused
+        for block, row_files, completed in iter_embedding_chunks(
+            [path_a, path_b, path_bad, path_c], chunk_size=4, on_unreadable=unreadable.append
+        )
+    ]
+
+    assert [len(block) for block, _, _ in chunks] == [4, 4, 2]
+    np.testing.assert_array_equal(np.vstack([block for block, _, _ in chunks]), np.vstack([a, b, c]))
+    assert [row_files for _, row_files, _ in chunks] == [
+        [path_a] * 3 + [path_b],
+        [path_b] * 4,
+        [path_c] * 2,
+    ]
+    assert [completed for _, _, completed in chunks] == [[path_a], [path_b], [path_c]]
+    assert unreadable == [path_bad]
+
+
+# ---------------------------
+# Similarity index
+# ---------------------------
+def _vectors(n, seed):
+    return np.abs(np.random.default_rng(seed).normal(size=(n, DIM))).astype(np.float32)
+
+
+def test_exact_index_grows_past_its_initial_capacity():
+    index = EmbeddingIndex(exact_max_size=5000)
+    batches = [_vectors(600, seed) for seed in range(3)]
+    for number, X in enumerate(batches):
+        index.add([f"r{number}-{row}" for row in range(len(X))], X)
+
+    assert index.is_exact
+    assert len(index) == 1800
+    assert list(index.ids[598:602]) == ["r0-598", "r0-599", "r1-0", "r1-1"]
+    matches = index.find_duplicates(np.vstack([batches[0][0], batches[2][-1]]))
+    assert [match for match, _ in matches] == ["r0-0", "r2-599"]
+
+
+def test_index_switches_to_ivf_and_keeps_growing(tmp_path):
+    index = EmbeddingIndex(exact_max_size=500)
+    batches = [_vectors(400, seed) for seed in range(3)]
+    for number, X in enumerate(batches):
+        index.add([f"r{number}-{row}" for row in range(len(X))], X)
+        assert index.is_exact == (number == 0)
+
+    assert len(index) == 1200
+    queries = np.vstack([X[[0, 399]] for X in batches])
+    expected = ["r0-0", "r0-399", "r1-0", "r1-399", "r2-0", "r2-399"]
+    assert [match for match, _ in index.find_duplicates(queries)] == expected
+
+    path = str(tmp_path / "index" / "embedding_index.npz")
+    index.save(path)
+    loaded = EmbeddingIndex.load(path)
+    assert not loaded.is_exact
+    assert len(loaded) == 1200
+    assert [match for match, _ in loaded.find_duplicates(queries)] == expected
+    # A different recording is not a duplicate
+    assert loaded.find_duplicates(_vectors(1, seed=99))[0][0] is None
+
+
+# ---------------------------
+# Run manifest
+# ---------------------------
+def test_run_manifest_invalidation(tmp_path):
+    manifest = RunManifest(str(tmp_path / "run_manifest.sqlite"))
+    artifact = tmp_path / "rec_embedding.rhde"
+    artifact.write_bytes(b"embedding")
+    params = {"hop_size": 0.1, "pooling": "mean"}
+
+    manifest.record("rec", "downloaded", "audio-hash")
+    manifest.record("rec", "embedded", "audio-hash", params, artifact=str(artifact))
+    manifest.record("rec", "scored", "embedding-hash", {"endpoint": "https://example"})
+
+    assert manifest.is_complete("rec", "embedded", "audio-hash", params)
+    assert not manifest.is_complete("rec", "embedded", "other-hash", params)
+    assert not manifest.is_complete("rec", "embedded", "audio-hash", dict(params, hop_size=0.5))
+
+    # Markers sit beside the stages and do not invalidate them
+    manifest.record("rec", UNREADABLE, "embedding-hash")
+    assert manifest.get("rec", "scored") is not None
+
+    # Redoing a stage drops the stages computed from its previous output
+    manifest.record("rec", "embedded", "audio-hash", dict(params, hop_size=0.5), artifact=str(artifact))
+    assert manifest.get("rec", "scored") is None
+    assert manifest.is_complete("rec", "downloaded", "audio-hash")
+    assert manifest.recordings_at("scored") == set()
+
+    # A stage whose artifact is gone has to run again
+    artifact.unlink()
+    assert not manifest.is_complete("rec", "embedded", "audio-hash", dict(params, hop_size=0.5))
+
+    with pytest.raises(ValueError):
+        manifest.record("rec", "transcoded")
+    manifest.close()